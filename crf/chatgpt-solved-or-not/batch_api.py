@@ -0,0 +1,290 @@
+import hashlib
+import json
+import time
+from collections.abc import Callable, Generator, Iterable, Iterator
+from pathlib import Path
+from typing import Protocol, TypedDict
+
+import jsonlines
+import openai
+import requests
+
+from custom_types import Example, Prediction
+from response_cache import ResponseCache
+
+# 1つのバッチファイルに入れられるリクエスト数の上限
+MAX_REQUESTS_PER_FILE = 50_000
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRequest(TypedDict):
+    custom_id: str
+    method: str
+    url: str
+    body: dict
+
+
+def build_batch_requests(
+    examples: Iterable[Example], model: str, temperature: float
+) -> Generator[BatchRequest, None, None]:
+    for example in examples:
+        yield BatchRequest(
+            custom_id=example["id"],
+            method="POST",
+            url="/v1/chat/completions",
+            body={
+                "model": model,
+                "messages": [{"role": "user", "content": example["prompt"]}],
+                "temperature": temperature,
+            },
+        )
+
+
+def requests_digest(requests_: Iterable[BatchRequest]) -> str:
+    """リクエストの内容（モデル・プロンプトなど）のハッシュ
+
+    >>> requests_ = list(build_batch_requests([{"id": "0", "prompt": "a"}], "m", 0.0))
+    >>> requests_digest(requests_) == requests_digest(requests_)
+    True
+    >>> requests_digest(requests_) == requests_digest(build_batch_requests([{"id": "0", "prompt": "b"}], "m", 0.0))
+    False
+    """
+    digest = hashlib.sha256()
+    for request in requests_:
+        digest.update(json.dumps(request, sort_keys=True).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def write_batch_files(
+    requests_: Iterable[BatchRequest],
+    work_dir: Path,
+    max_requests: int = MAX_REQUESTS_PER_FILE,
+) -> list[Path]:
+    work_dir.mkdir(parents=True, exist_ok=True)
+    paths: list[Path] = []
+    writer = None
+    for i, request in enumerate(requests_):
+        if i % max_requests == 0:
+            if writer is not None:
+                writer.close()
+            paths.append(work_dir / f"batch_input_{len(paths)}.jsonl")
+            writer = jsonlines.open(paths[-1], "w")
+        writer.write(request)
+    if writer is not None:
+        writer.close()
+    return paths
+
+
+class BatchBackend(Protocol):
+    def submit(self, input_path: Path) -> str:
+        """バッチファイルを投入し、バッチのidを返す"""
+
+    def status(self, batch_id: str) -> str:
+        """completed, failed, in_progressなどを返す"""
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        """custom_idとresponseを含む結果の行を返す"""
+
+
+class OpenAIBatchBackend:
+    """OpenAIのFiles APIとBatch APIを使う（openai 0.27にはないのでHTTPで直接呼ぶ）"""
+
+    def __init__(
+        self, api_key: str | None = None, api_base: str | None = None
+    ):
+        self.api_base = (api_base or openai.api_base).rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = (
+            f"Bearer {api_key or openai.api_key}"
+        )
+        # 最後に取得したバッチの情報
+        self.batches: dict[str, dict] = {}
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self._request(
+                "POST",
+                "/files",
+                data={"purpose": "batch"},
+                files={"file": (input_path.name, f)},
+            )
+        batch = self._request(
+            "POST",
+            "/batches",
+            json={
+                "input_file_id": uploaded["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h",
+            },
+        )
+        return batch["id"]
+
+    def status(self, batch_id: str) -> str:
+        batch = self._request("GET", f"/batches/{batch_id}")
+        self.batches[batch_id] = batch
+        return batch["status"]
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        if batch_id not in self.batches:
+            self.status(batch_id)
+        batch = self.batches[batch_id]
+        if batch.get("error_file_id"):
+            print(batch_id, "error_file_id:", batch["error_file_id"])
+        # failed, expiredなどで出力がないバッチのリクエストは応答なしとする
+        if not batch.get("output_file_id"):
+            print(batch_id, batch["status"], "has no output file")
+            return
+        response = self.session.get(
+            f"{self.api_base}/files/{batch['output_file_id']}/content"
+        )
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            yield json.loads(line)
+
+    def _request(self, method: str, path: str, **kwargs) -> dict:
+        response = self.session.request(
+            method, f"{self.api_base}{path}", **kwargs
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+class LocalBatchBackend:
+    """APIを呼ばずにその場で応答を作るバックエンド（動作確認・テスト用）
+
+    respondはプロンプトを受け取って応答の文字列を返す。
+    結果は入力ファイルの隣に書き出し、そのパスをバッチのidとする。
+    failが入力ファイルのパスに対してTrueを返すバッチは、出力なしのfailedになる
+    """
+
+    def __init__(
+        self,
+        respond: Callable[[str], str] = lambda prompt: "[]",
+        fail: Callable[[Path], bool] = lambda input_path: False,
+    ):
+        self.respond = respond
+        self.fail = fail
+
+    def submit(self, input_path: Path) -> str:
+        output_path = input_path.with_name(f"{input_path.stem}_output.jsonl")
+        if self.fail(input_path):
+            return str(output_path)
+        with jsonlines.open(input_path) as reader, jsonlines.open(
+            output_path, "w"
+        ) as writer:
+            writer.write_all(self._complete(request) for request in reader)
+        return str(output_path)
+
+    def status(self, batch_id: str) -> str:
+        return "completed" if Path(batch_id).exists() else "failed"
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        if not Path(batch_id).exists():
+            print(batch_id, "failed", "has no output file")
+            return
+        with jsonlines.open(batch_id) as reader:
+            yield from reader
+
+    def _complete(self, request: BatchRequest) -> dict:
+        prompt = request["body"]["messages"][-1]["content"]
+        content = self.respond(prompt)
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [
+                        {"message": {"role": "assistant", "content": content}}
+                    ]
+                },
+            },
+            "error": None,
+        }
+
+
+def submit_batches(
+    backend: BatchBackend, input_paths: list[Path], work_dir: Path
+) -> list[str]:
+    """投入したバッチのidをwork_dirに記録する（再実行時は投入し直さない）"""
+    ids_path = work_dir / "batch_ids.json"
+    if ids_path.exists():
+        return json.loads(ids_path.read_text())
+    batch_ids = [backend.submit(path) for path in input_paths]
+    ids_path.write_text(json.dumps(batch_ids))
+    return batch_ids
+
+
+def wait_for_batches(
+    backend: BatchBackend, batch_ids: list[str], poll_interval: float
+) -> None:
+    pending = set(batch_ids)
+    while pending:
+        for batch_id in sorted(pending):
+            status = backend.status(batch_id)
+            if status in TERMINAL_STATUSES:
+                print(batch_id, status)
+                pending.discard(batch_id)
+        if pending:
+            time.sleep(poll_interval)
+
+
+def collect_responses(
+    backend: BatchBackend, batch_ids: list[str]
+) -> dict[str, dict]:
+    """custom_id → 成功したリクエストのレスポンス（Chat Completions APIと同じ形）"""
+    responses = {}
+    for batch_id in batch_ids:
+        for line in backend.results(batch_id):
+            response = line.get("response") or {}
+            if response.get("status_code") != 200:
+                print(line["custom_id"], line.get("error"))
+                continue
+            responses[line["custom_id"]] = response["body"]
+    return responses
+
+
+def run_batch(
+    examples: list[Example],
+    backend: BatchBackend,
+    work_dir: Path,
+    model: str = "gpt-3.5-turbo-0301",
+    temperature: float = 0.0,
+    poll_interval: float = 60.0,
+    cache: ResponseCache | None = None,
+) -> Generator[Prediction, None, None]:
+    """examplesをバッチで処理し、examplesと同じ順でPredictionを返す
+
+    cacheにあるものはバッチに入れず、バッチで得たレスポンスはcacheに保存する。
+    リクエストの内容ごとにwork_dirの下のディレクトリを分ける（同じ内容なら再実行で続きから）。
+    失敗したリクエストのresponseはNone（post_processですべてOになる）
+    """
+    responses = {}
+    if cache is not None:
+        for example in examples:
+            cached = cache.get(model, temperature, example["prompt"])
+            if cached is not None:
+                responses[example["id"]] = cached
+    uncached = [e for e in examples if e["id"] not in responses]
+    if uncached:
+        requests_ = list(build_batch_requests(uncached, model, temperature))
+        batch_dir = work_dir / requests_digest(requests_)[:16]
+        input_paths = write_batch_files(requests_, batch_dir)
+        batch_ids = submit_batches(backend, input_paths, batch_dir)
+        wait_for_batches(backend, batch_ids, poll_interval)
+        batch_responses = collect_responses(backend, batch_ids)
+        if cache is not None:
+            for example in uncached:
+                if example["id"] in batch_responses:
+                    cache.put(
+                        model,
+                        temperature,
+                        example["prompt"],
+                        batch_responses[example["id"]],
+                    )
+        responses |= batch_responses
+    for example in examples:
+        response = responses.get(example["id"])
+        if response is not None:
+            response = response["choices"][0]["message"]["content"].strip()
+        yield example | {"response": response}
@@ -0,0 +1,56 @@
+import argparse
+import time
+from pathlib import Path
+
+import jsonlines
+
+from postprocess_predictions import parse_response
+from response_parser import scan_response
+
+
+def parse_or_empty(response: str | None) -> list[list[str]]:
+    try:
+        return parse_response(response)
+    except ValueError:
+        return []
+
+
+def benchmark(responses: list[str | None], repeat: int = 5) -> None:
+    for parse in (parse_or_empty, scan_response):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for response in responses:
+                parse(response)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(
+            f"{parse.__name__}: {elapsed * 1000:.1f} ms "
+            f"({len(responses) / elapsed:.0f} responses/sec)"
+        )
+
+    n_failed = n_salvaged = n_different = 0
+    for response in responses:
+        scanned = scan_response(response)
+        try:
+            parsed = parse_response(response)
+        except ValueError:
+            n_failed += 1
+            n_salvaged += bool(scanned)
+            continue
+        if [list(pair) for pair in parsed if len(pair) == 2] != scanned:
+            n_different += 1
+    print(
+        f"{len(responses)} responses: parse_response raised on {n_failed} "
+        f"(scan_response salvaged pairs from {n_salvaged}), "
+        f"{n_different} parsed differently"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("predictions_jsonl", type=Path)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with jsonlines.open(args.predictions_jsonl) as reader:
+        responses = [prediction["response"] for prediction in reader]
+    benchmark(responses, args.repeat)
@@ -0,0 +1,150 @@
+import argparse
+import itertools
+import time
+from pathlib import Path
+
+import numpy as np
+
+from evaluate import Span, extract_spans, iter_tags
+
+# 1度に作るリサンプルの数（重み行列 batch × 文数 がメモリに載る大きさにする）
+BATCH_SIZE = 1000
+
+
+def sentence_counts(
+    predictions_paths: list[Path],
+) -> tuple[list[str], dict[Path, np.ndarray]]:
+    """実行ごとに、文ごとの(TP, FP, FN)を(文数, 3)の配列にする
+
+    対応のある比較ができるよう、すべての実行にあるidだけを同じ順に並べる
+    """
+    gold_spans: dict[str, set[Span]] = {}
+    counts_by_id = {}
+    for path in predictions_paths:
+        counts = counts_by_id[path] = {}
+        for id_, true_tags, predicted_tags in iter_tags(path):
+            if id_ not in gold_spans:
+                gold_spans[id_] = set(extract_spans(true_tags))
+            true_spans = gold_spans[id_]
+            pred_spans = set(extract_spans(predicted_tags))
+            counts[id_] = (
+                len(true_spans & pred_spans),
+                len(pred_spans - true_spans),
+                len(true_spans - pred_spans),
+            )
+
+    first, *rest = counts_by_id.values()
+    ids = [id_ for id_ in first if all(id_ in counts for counts in rest)]
+    return ids, {
+        path: np.array([counts[id_] for id_ in ids], dtype=np.int64)
+        for path, counts in counts_by_id.items()
+    }
+
+
+def f1_scores(totals: np.ndarray) -> np.ndarray:
+    """(..., 3)の(TP, FP, FN)の合計からmicro F1を求める
+
+    >>> f1_scores(np.array([[3, 1, 1], [0, 0, 0]]))
+    array([0.75, 0.  ])
+    """
+    tp, fp, fn = np.moveaxis(totals, -1, 0)
+    denominator = 2 * tp + fp + fn
+    return np.divide(
+        2 * tp,
+        denominator,
+        out=np.zeros(denominator.shape),
+        where=denominator != 0,
+    )
+
+
+def resample_weights(
+    rng: np.random.Generator, n_sentences: int, n_resamples: int
+):
+    """各文が何回選ばれたかを(リサンプル数, 文数)の行列でbatchずつ返す"""
+    for start in range(0, n_resamples, BATCH_SIZE):
+        size = min(BATCH_SIZE, n_resamples - start)
+        yield rng.multinomial(
+            n_sentences, np.full(n_sentences, 1 / n_sentences), size=size
+        )
+
+
+def bootstrap(
+    counts: dict[Path, np.ndarray],
+    n_resamples: int = 10_000,
+    seed: int = 0,
+) -> dict[Path, np.ndarray]:
+    """実行ごとのF1のブートストラップ分布。全実行で同じリサンプルを使う"""
+    rng = np.random.default_rng(seed)
+    n_sentences = len(next(iter(counts.values())))
+    scores = {path: [] for path in counts}
+    for weights in resample_weights(rng, n_sentences, n_resamples):
+        for path, run_counts in counts.items():
+            scores[path].append(f1_scores(weights @ run_counts))
+    return {path: np.concatenate(batches) for path, batches in scores.items()}
+
+
+def permutation_test(
+    counts_a: np.ndarray,
+    counts_b: np.ndarray,
+    n_permutations: int = 10_000,
+    seed: int = 0,
+) -> float:
+    """文ごとにAとBの結果をランダムに入れ替える対応のある並べ替え検定（両側）のp値"""
+    rng = np.random.default_rng(seed)
+    total_a = counts_a.sum(axis=0)
+    total_b = counts_b.sum(axis=0)
+    observed = abs(f1_scores(total_a) - f1_scores(total_b))
+    difference = counts_b - counts_a
+
+    n_extreme = 0
+    for start in range(0, n_permutations, BATCH_SIZE):
+        size = min(BATCH_SIZE, n_permutations - start)
+        swapped = rng.integers(0, 2, size=(size, len(counts_a)))
+        shift = swapped @ difference
+        permuted = f1_scores(total_a + shift) - f1_scores(total_b - shift)
+        n_extreme += np.count_nonzero(np.abs(permuted) >= observed - 1e-12)
+    return (n_extreme + 1) / (n_permutations + 1)
+
+
+def confidence_interval(
+    samples: np.ndarray, confidence: float
+) -> tuple[float, float]:
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("predictions_jsonl", type=Path, nargs="+")
+    parser.add_argument("--n_resamples", type=int, default=10_000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ids, counts = sentence_counts(args.predictions_jsonl)
+    samples = bootstrap(counts, args.n_resamples, args.seed)
+    print(f"{len(ids)} sentences, {args.n_resamples} resamples")
+    for path, run_counts in counts.items():
+        low, high = confidence_interval(samples[path], args.confidence)
+        print(
+            f"{path}: F1 {f1_scores(run_counts.sum(axis=0)):.4f} "
+            f"[{low:.4f}, {high:.4f}]"
+        )
+
+    for path_a, path_b in itertools.combinations(counts, 2):
+        low, high = confidence_interval(
+            samples[path_a] - samples[path_b], args.confidence
+        )
+        p_value = permutation_test(
+            counts[path_a], counts[path_b], args.n_resamples, args.seed
+        )
+        difference = f1_scores(counts[path_a].sum(axis=0)) - f1_scores(
+            counts[path_b].sum(axis=0)
+        )
+        print(
+            f"{path_a} - {path_b}: {difference:+.4f} "
+            f"[{low:+.4f}, {high:+.4f}], p={p_value:.4f}"
+        )
+    print(f"{time.perf_counter() - start:.1f} sec")
@@ -0,0 +1,76 @@
+import argparse
+from pathlib import Path
+
+import jsonlines
+from seqeval.metrics import f1_score
+
+from constants import index2tag
+from custom_types import ParsedPrediction
+from rate_limit import estimate_tokens
+
+
+def count_prompt_tokens(prompts_path: Path) -> tuple[int, int]:
+    """プロンプトのファイルのリクエスト数と、推定入力トークン数の合計"""
+    n_requests = n_tokens = 0
+    with jsonlines.open(prompts_path) as reader:
+        for example in reader:
+            n_requests += 1
+            n_tokens += estimate_tokens(example["prompt"], completion_tokens=0)
+    return n_requests, n_tokens
+
+
+def load_by_id(predictions_path: Path) -> dict[str, ParsedPrediction]:
+    with jsonlines.open(predictions_path) as reader:
+        return {prediction["id"]: prediction for prediction in reader}
+
+
+def sentence_scores(
+    predictions: dict[str, ParsedPrediction], ids: list[str]
+) -> dict[str, float]:
+    y_true = [
+        [index2tag[i] for i in predictions[id_]["ner_tags"]] for id_ in ids
+    ]
+    y_pred = [
+        [index2tag[i] for i in predictions[id_]["predicted_tags"]]
+        for id_ in ids
+    ]
+    exact_match = sum(t == p for t, p in zip(y_true, y_pred)) / len(ids)
+    return {
+        "sentence_accuracy": exact_match,
+        "f1_score": f1_score(y_true, y_pred),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("single_prompts_jsonl", type=Path)
+    parser.add_argument("packed_prompts_jsonl", type=Path)
+    parser.add_argument("--single_predictions", type=Path)
+    parser.add_argument("--packed_predictions", type=Path)
+    args = parser.parse_args()
+
+    single_requests, single_tokens = count_prompt_tokens(
+        args.single_prompts_jsonl
+    )
+    packed_requests, packed_tokens = count_prompt_tokens(
+        args.packed_prompts_jsonl
+    )
+    print(f"single: {single_requests} requests, ~{single_tokens} tokens")
+    print(f"packed: {packed_requests} requests, ~{packed_tokens} tokens")
+    print(
+        f"saved: {1 - packed_requests / single_requests:.1%} requests, "
+        f"{1 - packed_tokens / single_tokens:.1%} prompt tokens"
+    )
+
+    if args.single_predictions and args.packed_predictions:
+        single = load_by_id(args.single_predictions)
+        packed = load_by_id(args.packed_predictions)
+        ids = sorted(single.keys() & packed.keys(), key=int)
+        agreement = sum(
+            single[id_]["predicted_tags"] == packed[id_]["predicted_tags"]
+            for id_ in ids
+        ) / len(ids)
+        print(f"{len(ids)} sentences in both runs")
+        print("single:", sentence_scores(single, ids))
+        print("packed:", sentence_scores(packed, ids))
+        print(f"same predicted tags: {agreement:.1%}")
@@ -0,0 +1,134 @@
+import argparse
+import filecmp
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import jsonlines
+
+from create_prompts import load_test_set
+from custom_types import Conll03Example, Example
+from instructions import get_instruction
+
+INSTRUCTION_NUMBERS = (1, 2, 3, 4, 5)
+PROMPTS_FILENAME = "prompts.jsonl"
+
+
+def build_plain_template(instruction_number: int) -> str:
+    """LangChainを通さず、str.formatでそのまま使えるテンプレート
+
+    >>> build_plain_template(1).endswith('Given sentence:\\n"{sentence}"')
+    True
+    """
+    return (
+        get_instruction(instruction_number) + 'Given sentence:\n"{sentence}"'
+    )
+
+
+def write_prompts(
+    output_path: Path,
+    template: str,
+    examples: list[Conll03Example],
+    sentences: list[str],
+) -> Path:
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with jsonlines.open(output_path, "w") as writer:
+        writer.write_all(
+            Example(**example, prompt=template.format(sentence=sentence))
+            for example, sentence in zip(examples, sentences)
+        )
+    return output_path
+
+
+def create_all_prompts(
+    output_dir: Path, instruction_numbers=INSTRUCTION_NUMBERS
+) -> list[Path]:
+    """テストセットを1度だけ読み、output_dir/<番号>/prompts.jsonlを並行して書き出す"""
+    examples = list(load_test_set())
+    # 文の組み立ては指示文によらないので1度だけ行う
+    sentences = [" ".join(example["tokens"]) for example in examples]
+    with ThreadPoolExecutor(len(instruction_numbers)) as executor:
+        futures = [
+            executor.submit(
+                write_prompts,
+                output_dir / str(number) / PROMPTS_FILENAME,
+                build_plain_template(number),
+                examples,
+                sentences,
+            )
+            for number in instruction_numbers
+        ]
+        return [future.result() for future in futures]
+
+
+def run_shell_loop(output_dir: Path, instruction_numbers) -> None:
+    """prepare.shと同じく、指示文ごとにcreate_prompts.pyを実行する"""
+    for number in instruction_numbers:
+        output_path = output_dir / str(number) / PROMPTS_FILENAME
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        subprocess.run(
+            [
+                sys.executable,
+                "create_prompts.py",
+                str(output_path),
+                "--instruction_number",
+                str(number),
+            ],
+            check=True,
+        )
+
+
+def compare_with_shell_loop(instruction_numbers=INSTRUCTION_NUMBERS) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        loop_dir = Path(tmp_dir) / "loop"
+        all_dir = Path(tmp_dir) / "all"
+
+        start = time.perf_counter()
+        run_shell_loop(loop_dir, instruction_numbers)
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        create_all_prompts(all_dir, instruction_numbers)
+        all_seconds = time.perf_counter() - start
+
+        for number in instruction_numbers:
+            relative_path = Path(str(number)) / PROMPTS_FILENAME
+            if not filecmp.cmp(
+                loop_dir / relative_path, all_dir / relative_path, False
+            ):
+                print(f"{relative_path} differs")
+
+    print(f"shell loop: {loop_seconds:.2f} sec")
+    print(
+        f"create_all_prompts: {all_seconds:.2f} sec "
+        f"({loop_seconds / all_seconds:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_dir", type=Path, nargs="?", default="data")
+    parser.add_argument(
+        "--instruction_numbers",
+        type=int,
+        nargs="+",
+        choices=INSTRUCTION_NUMBERS,
+        default=list(INSTRUCTION_NUMBERS),
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="time against running create_prompts.py once per instruction",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_with_shell_loop(args.instruction_numbers)
+    else:
+        for path in create_all_prompts(
+            args.output_dir, args.instruction_numbers
+        ):
+            print(path)
@@ -1,13 +1,14 @@
 import argparse
 from collections.abc import Generator
+from itertools import islice
 from typing import Literal
 
 import jsonlines
 from datasets import load_dataset
 from langchain.prompts import HumanMessagePromptTemplate
 
-from custom_types import Conll03Example, Example
-from instructions import get_instruction
+from custom_types import Conll03Example, Example, PackedExample
+from instructions import get_instruction, get_packed_instruction
 
 
 def load_test_set() -> Generator[Conll03Example, None, None]:
@@ -46,13 +47,54 @@ def create_prompts(
         )
 
 
+def build_packed_prompt(
+    instruction_number: Literal[1, 2, 3, 4, 5], sentences: list[str]
+) -> str:
+    numbered_sentences = "\n".join(
+        f'{number}: "{sentence}"'
+        for number, sentence in enumerate(sentences, start=1)
+    )
+    return (
+        get_packed_instruction(instruction_number)
+        + "Given sentences:\n"
+        + numbered_sentences
+    )
+
+
+def create_packed_prompts(
+    instruction_number: Literal[1, 2, 3, 4, 5], pack_size: int
+) -> Generator[PackedExample, None, None]:
+    """pack_size文ずつ1つのプロンプトにまとめる（指示文の繰り返しとリクエスト数を減らす）"""
+    examples = load_test_set()
+    while packed := list(islice(examples, pack_size)):
+        yield PackedExample(
+            id=",".join(example["id"] for example in packed),
+            examples=packed,
+            prompt=build_packed_prompt(
+                instruction_number,
+                [" ".join(example["tokens"]) for example in packed],
+            ),
+        )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("output_jsonl")
     parser.add_argument(
         "--instruction_number", type=int, choices=[1, 2, 3, 4, 5], default=2
     )
+    parser.add_argument(
+        "--pack_size",
+        type=int,
+        default=1,
+        help="number of sentences packed into one prompt",
+    )
     args = parser.parse_args()
 
     with jsonlines.open(args.output_jsonl, "w") as writer:
-        writer.write_all(create_prompts(args.instruction_number))
+        if args.pack_size > 1:
+            writer.write_all(
+                create_packed_prompts(args.instruction_number, args.pack_size)
+            )
+        else:
+            writer.write_all(create_prompts(args.instruction_number))
@@ -12,8 +12,20 @@ class Example(Conll03Example):
 
 
 class Prediction(Example):
-    response: str
+    response: str | None
 
 
 class ParsedPrediction(Prediction):
     predicted_tags: list[int]
+
+
+class PackedExample(TypedDict):
+    """複数の文を1つのプロンプトにまとめたもの（idは各文のidをカンマでつないだもの）"""
+
+    id: str
+    examples: list[Conll03Example]
+    prompt: str
+
+
+class PackedPrediction(PackedExample):
+    response: str | None
@@ -1,50 +1,212 @@
 import argparse
 import json
+from collections.abc import Generator
 from pathlib import Path
 
-import jsonlines
-from seqeval.metrics import (
-    classification_report,
-    f1_score,
-    precision_score,
-    recall_score,
-)
+import orjson
 
-from constants import index2tag
-from custom_types import ParsedPrediction
+from constants import ner_tags
 
+# タグのid → 固有表現タイプのid。B-XとI-Xは続けて並んでいる（O=0, B-PER=1, I-PER=2, ...）
+ENTITY_TYPES = [
+    tag[2:]
+    for tag, _ in sorted(ner_tags.items(), key=lambda item: item[1])
+    if tag.startswith("B-")
+]
+Span = tuple[int, int, int]
 
-def load_labels(
-    predictions_path: Path,
-) -> tuple[list[list[str]], list[list[str]]]:
-    predictions = load_predictions(predictions_path)
-    y_true = [[index2tag[idx] for idx in p["ner_tags"]] for p in predictions]
-    y_pred = [
-        [index2tag[idx] for idx in p["predicted_tags"]] for p in predictions
-    ]
-    return y_true, y_pred
+
+def extract_spans(tags: list[int]) -> list[Span]:
+    """タグのidの列から(タイプのid, 開始, 終了)の固有表現を取り出す（seqevalのデフォルトと同じ規則）
+
+    >>> extract_spans([1, 2, 0, 5])  # B-PER I-PER O B-LOC
+    [(0, 0, 2), (2, 3, 4)]
+    >>> extract_spans([0, 6, 6, 4])  # Oの後のI-、タイプの違うI-は新しい固有表現の始まり
+    [(2, 1, 3), (1, 3, 4)]
+    """
+    spans = []
+    start = entity_type = None
+    for index, tag in enumerate(tags):
+        if tag == ner_tags["O"]:
+            if start is not None:
+                spans.append((entity_type, start, index))
+                start = None
+            continue
+        tag_type, is_inside = divmod(tag - 1, 2)
+        if is_inside and start is not None and tag_type == entity_type:
+            continue
+        if start is not None:
+            spans.append((entity_type, start, index))
+        start, entity_type = index, tag_type
+    if start is not None:
+        spans.append((entity_type, start, len(tags)))
+    return spans
+
+
+class SpanCounter:
+    """固有表現タイプごとのTP/FP/FNを、文ごとに足していく"""
+
+    def __init__(self) -> None:
+        self.true_positives = [0] * len(ENTITY_TYPES)
+        self.false_positives = [0] * len(ENTITY_TYPES)
+        self.false_negatives = [0] * len(ENTITY_TYPES)
+
+    def update(self, true_spans: set[Span], pred_spans: set[Span]) -> None:
+        for entity_type, _, _ in true_spans & pred_spans:
+            self.true_positives[entity_type] += 1
+        for entity_type, _, _ in pred_spans - true_spans:
+            self.false_positives[entity_type] += 1
+        for entity_type, _, _ in true_spans - pred_spans:
+            self.false_negatives[entity_type] += 1
+
+    def scores(self) -> dict[str, dict[str, float]]:
+        """seqevalのclassification_report(output_dict=True)と同じ値"""
+        rows = {}
+        for entity_type, name in enumerate(ENTITY_TYPES):
+            tp = self.true_positives[entity_type]
+            fp = self.false_positives[entity_type]
+            fn = self.false_negatives[entity_type]
+            if tp + fp + fn > 0:  # 正解にも予測にも出てこないタイプは除く
+                rows[name] = _scores(tp, fp, fn)
+        rows = dict(sorted(rows.items()))
+
+        support = sum(row["support"] for row in rows.values())
+        averages = {
+            "micro avg": _scores(
+                sum(self.true_positives),
+                sum(self.false_positives),
+                sum(self.false_negatives),
+            ),
+            "macro avg": {
+                metric: _mean([row[metric] for row in rows.values()])
+                for metric in ("precision", "recall", "f1-score")
+            },
+            "weighted avg": {
+                metric: _divide(
+                    sum(row[metric] * row["support"] for row in rows.values()),
+                    support,
+                )
+                for metric in ("precision", "recall", "f1-score")
+            },
+        }
+        for average in averages.values():
+            average["support"] = support
+        return rows | averages
+
+    def summary(self) -> dict[str, float]:
+        micro = self.scores()["micro avg"]
+        return {
+            "precision": micro["precision"],
+            "recall": micro["recall"],
+            "f1_score": micro["f1-score"],
+        }
+
+    def report(self, digits: int = 2) -> str:
+        # seqevalのclassification_reportと同じ書式
+        scores = self.scores()
+        width = max(*map(len, scores), digits)
+        head_fmt = "{:>{width}s} " + " {:>9}" * 4
+        row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}"
+        lines = [
+            head_fmt.format(
+                "", "precision", "recall", "f1-score", "support", width=width
+            ),
+            "",
+        ]
+        for name, row in scores.items():
+            if name == "micro avg":
+                lines.append("")
+            lines.append(
+                row_fmt.format(name, *row.values(), width=width, digits=digits)
+            )
+        lines.append("")
+        return "\n".join(lines)
 
 
-def load_predictions(predictions_path: Path) -> list[ParsedPrediction]:
-    with jsonlines.open(predictions_path) as reader:
-        return list(reader)
+def _divide(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else 0.0
 
 
-def evaluate(
-    y_true: list[list[str]], y_pred: list[list[str]]
-) -> dict[str, float]:
+def _mean(values: list[float]) -> float:
+    return _divide(sum(values), len(values))
+
+
+def _scores(tp: int, fp: int, fn: int) -> dict[str, float]:
+    precision = _divide(tp, tp + fp)
+    recall = _divide(tp, tp + fn)
     return {
-        "precision": precision_score(y_true, y_pred),
-        "recall": recall_score(y_true, y_pred),
-        "f1_score": f1_score(y_true, y_pred),
+        "precision": precision,
+        "recall": recall,
+        "f1-score": _divide(2 * precision * recall, precision + recall),
+        "support": tp + fn,
     }
 
 
+def iter_tags(
+    predictions_path: Path,
+) -> Generator[tuple[str, list[int], list[int]], None, None]:
+    with open(predictions_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                prediction = orjson.loads(line)
+                yield (
+                    prediction["id"],
+                    prediction["ner_tags"],
+                    prediction["predicted_tags"],
+                )
+
+
+def evaluate_runs(predictions_paths: list[Path]) -> dict[Path, SpanCounter]:
+    """複数の実行結果を1ファイルずつ流し読みして集計する
+
+    正解の固有表現はidごとに1度だけ取り出し、実行の間で使い回す
+    """
+    gold_spans: dict[str, set[Span]] = {}
+    counters = {}
+    for path in predictions_paths:
+        counter = counters[path] = SpanCounter()
+        for id_, true_tags, predicted_tags in iter_tags(path):
+            if id_ not in gold_spans:
+                gold_spans[id_] = set(extract_spans(true_tags))
+            counter.update(gold_spans[id_], set(extract_spans(predicted_tags)))
+    return counters
+
+
+def comparison_table(counters: dict[Path, SpanCounter]) -> str:
+    """実行ごとのmicro平均のP/R/F1とタイプごとのF1を1行ずつ並べる"""
+    headers = ["precision", "recall", "f1-score", *ENTITY_TYPES]
+    width = max(len(str(path)) for path in counters)
+    lines = [
+        ("{:<{width}s}" + " {:>9}" * len(headers)).format(
+            "run", *headers, width=width
+        )
+    ]
+    for path, counter in counters.items():
+        scores = counter.scores()
+        values = [
+            scores["micro avg"][metric]
+            for metric in ("precision", "recall", "f1-score")
+        ] + [
+            scores.get(name, {"f1-score": 0.0})["f1-score"]
+            for name in ENTITY_TYPES
+        ]
+        lines.append(
+            ("{:<{width}s}" + " {:>9.4f}" * len(values)).format(
+                str(path), *values, width=width
+            )
+        )
+    return "\n".join(lines)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("predictions_jsonl", type=Path)
+    parser.add_argument("predictions_jsonl", type=Path, nargs="+")
     args = parser.parse_args()
 
-    y_true, y_pred = load_labels(args.predictions_jsonl)
-    print(classification_report(y_true, y_pred))
-    print(json.dumps(evaluate(y_true, y_pred)))
+    counters = evaluate_runs(args.predictions_jsonl)
+    if len(counters) == 1:
+        (counter,) = counters.values()
+        print(counter.report())
+        print(json.dumps(counter.summary()))
+    else:
+        print(comparison_table(counters))
@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web
+
+from rate_limit import estimate_tokens
+
+WINDOW_SECONDS = 60.0
+
+
+class FakeChatServer:
+    """Chat Completions APIの代わりに負荷試験で使うローカルサーバー
+
+    応答までの時間は対数正規分布（中央値latency_median秒）。
+    error_rateの割合で500を、rate_limit_rateの割合で429を返す。
+    rpm, tpmを指定すると、直近60秒の合計がそれを超えるリクエストに429を返す。
+    Files API・Batch APIも受け付け、batch_failure_rateの割合のバッチを出力なしのfailedにする
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        rpm: int | None = None,
+        tpm: int | None = None,
+        content: str = "[]",
+        seed: int = 0,
+        batch_failure_rate: float = 0.0,
+    ) -> None:
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.content = content
+        self.rng = random.Random(seed)
+        # 直近60秒に受け付けた(時刻, トークン数)
+        self.window: deque[tuple[float, int]] = deque()
+        self.window_tokens = 0
+        self.batch_failure_rate = batch_failure_rate
+        # Files API・Batch APIで作ったもの（id → 中身）
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        app.router.add_post("/v1/files", self.upload_file)
+        app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        app.router.add_post("/v1/batches", self.create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.retrieve_batch)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        tokens = estimate_tokens(prompt)
+
+        if self.rng.random() < self.error_rate:
+            return self.error(500, "The server had an error", "server_error")
+        if self.rng.random() < self.rate_limit_rate or not self.admit(tokens):
+            return self.error(
+                429,
+                "Rate limit reached",
+                "rate_limit_exceeded",
+                self.rate_limit_headers(),
+            )
+
+        await asyncio.sleep(
+            self.rng.lognormvariate(
+                math.log(self.latency_median), self.latency_sigma
+            )
+        )
+        return web.json_response(
+            self.completion(body),
+            headers=self.rate_limit_headers(),
+        )
+
+    async def upload_file(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        file_id = self.add_file(form["file"].file.read())
+        return web.json_response(
+            {"id": file_id, "object": "file", "purpose": form["purpose"]}
+        )
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        file_id = request.match_info["file_id"]
+        if file_id not in self.files:
+            return self.error(404, "No such file", "not_found")
+        return web.Response(body=self.files[file_id])
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        requests_ = [
+            json.loads(line)
+            for line in self.files[body["input_file_id"]].splitlines()
+        ]
+        if self.rng.random() < self.batch_failure_rate:
+            # 期限切れなどで出力がなく、エラーのファイルだけがある状態
+            status, output_file_id = "failed", None
+            error_file_id = self.add_lines(
+                {
+                    "custom_id": batch_request["custom_id"],
+                    "response": None,
+                    "error": {
+                        "code": "batch_failed",
+                        "message": "The batch failed",
+                    },
+                }
+                for batch_request in requests_
+            )
+        else:
+            status, error_file_id = "completed", None
+            output_file_id = self.add_lines(
+                {
+                    "custom_id": batch_request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": self.completion(batch_request["body"]),
+                    },
+                    "error": None,
+                }
+                for batch_request in requests_
+            )
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            # 最初の問い合わせまではin_progressとし、ポーリングを1回は挟む
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "result": (status, output_file_id, error_file_id),
+        }
+        return web.json_response(self.public_batch(batch_id))
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        batch_id = request.match_info["batch_id"]
+        if batch_id not in self.batches:
+            return self.error(404, "No such batch", "not_found")
+        response = web.json_response(self.public_batch(batch_id))
+        batch = self.batches[batch_id]
+        (
+            batch["status"],
+            batch["output_file_id"],
+            batch["error_file_id"],
+        ) = batch["result"]
+        return response
+
+    def public_batch(self, batch_id: str) -> dict:
+        return {
+            key: value
+            for key, value in self.batches[batch_id].items()
+            if key != "result"
+        }
+
+    def add_file(self, content: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = content
+        return file_id
+
+    def add_lines(self, lines) -> str:
+        return self.add_file(
+            "".join(json.dumps(line) + "\n" for line in lines).encode()
+        )
+
+    def completion(self, body: dict) -> dict:
+        tokens = estimate_tokens(body["messages"][-1]["content"])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": tokens,
+                "completion_tokens": 0,
+                "total_tokens": tokens,
+            },
+        }
+
+    def admit(self, tokens: int) -> bool:
+        now = time.monotonic()
+        while self.window and self.window[0][0] <= now - WINDOW_SECONDS:
+            self.window_tokens -= self.window.popleft()[1]
+        if self.rpm is not None and len(self.window) >= self.rpm:
+            return False
+        if self.tpm is not None and self.window_tokens + tokens > self.tpm:
+            return False
+        self.window.append((now, tokens))
+        self.window_tokens += tokens
+        return True
+
+    def rate_limit_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.window:
+            # 一番古いリクエストが窓から外れるまでの時間
+            reset = self.window[0][0] + WINDOW_SECONDS - time.monotonic()
+            reset = f"{max(reset, 0.0):.3f}s"
+        else:
+            reset = "0s"
+        if self.rpm is not None:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(
+                max(self.rpm - len(self.window), 0)
+            )
+            headers["x-ratelimit-reset-requests"] = reset
+        if self.tpm is not None:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(
+                max(self.tpm - self.window_tokens, 0)
+            )
+            headers["x-ratelimit-reset-tokens"] = reset
+        return headers
+
+    @staticmethod
+    def error(
+        status: int,
+        message: str,
+        code: str,
+        headers: dict[str, str] | None = None,
+    ) -> web.Response:
+        return web.json_response(
+            {"error": {"message": message, "type": code, "code": code}},
+            status=status,
+            headers=headers,
+        )
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0
+    ) -> tuple[web.AppRunner, str]:
+        """バックグラウンドで起動し、(runner, api_base)を返す。port=0なら空いているポート"""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        host, port, *_ = runner.addresses[0]
+        return runner, f"http://{host}:{port}/v1"
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency_median", type=float, default=0.5)
+    parser.add_argument("--latency_sigma", type=float, default=0.5)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--server_rpm", type=int)
+    parser.add_argument("--server_tpm", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch_failure_rate", type=float, default=0.0)
+
+
+def server_from_args(args: argparse.Namespace) -> FakeChatServer:
+    return FakeChatServer(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rpm=args.server_rpm,
+        tpm=args.server_tpm,
+        seed=args.seed,
+        batch_failure_rate=args.batch_failure_rate,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    # openai.api_base = "http://127.0.0.1:8000/v1" として使う
+    web.run_app(server_from_args(args).app(), host=args.host, port=args.port)
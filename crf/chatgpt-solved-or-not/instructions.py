@@ -41,6 +41,11 @@ What named entities are mentioned in the given sentence? Only return named entit
 )
 
 
+packed_answer_instruction = """\
+There are multiple sentences. For each sentence, answer in one line starting with the sentence number and a colon, like 1: ["entity_type", "entity_name"], ["entity_type", "entity_name"]. If no entity exists in a sentence, then just answer "[]" after its number.
+"""
+
+
 def get_instruction(number: Literal[1, 2, 3, 4, 5]) -> str:
     instructions = {
         1: instruction1,
@@ -50,3 +55,7 @@ def get_instruction(number: Literal[1, 2, 3, 4, 5]) -> str:
         5: instruction5,
     }
     return instructions[number] + answer_instruction
+
+
+def get_packed_instruction(number: Literal[1, 2, 3, 4, 5]) -> str:
+    return get_instruction(number) + packed_answer_instruction
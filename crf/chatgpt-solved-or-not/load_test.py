@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+import numpy as np
+import openai
+
+from custom_types import Example
+from fake_openai_server import (
+    FakeChatServer,
+    add_server_arguments,
+    server_from_args,
+)
+from openai_api import call_api, load_examples
+from rate_limit import RateLimiter
+
+
+class RequestRecorder:
+    """aiohttpのトレースで、HTTPリクエスト1回ごとの所要時間とステータスを記録する"""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.statuses: Counter[int] = Counter()
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self.on_request_start)
+        trace_config.on_request_end.append(self.on_request_end)
+        return trace_config
+
+    async def on_request_start(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        context.started_at = time.perf_counter()
+
+    async def on_request_end(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestEndParams,
+    ) -> None:
+        self.latencies.append(time.perf_counter() - context.started_at)
+        self.statuses[params.response.status] += 1
+
+
+def synthetic_examples(n: int) -> list[Example]:
+    return [
+        Example(
+            id=str(i),
+            tokens=["SOCCER", "-", "JAPAN"],
+            ner_tags=[0, 0, 5],
+            prompt=f'Given sentence:\n"SOCCER - JAPAN {i}"',
+        )
+        for i in range(n)
+    ]
+
+
+async def run_config(
+    server: FakeChatServer,
+    examples: list[Example],
+    concurrency: int,
+    limiter: RateLimiter | None,
+) -> dict[str, float]:
+    runner, api_base = await server.start()
+    openai.api_base = api_base
+    recorder = RequestRecorder()
+    try:
+        async with aiohttp.ClientSession(
+            trace_configs=[recorder.trace_config()]
+        ) as session:
+            # openai_apiのリクエストもこのセッションを通す
+            openai.aiosession.set(session)
+            start = time.perf_counter()
+            predictions = [
+                prediction
+                async for prediction in call_api(
+                    examples, concurrency, limiter=limiter
+                )
+            ]
+            elapsed = time.perf_counter() - start
+    finally:
+        openai.aiosession.set(None)
+        await runner.cleanup()
+
+    n_succeeded = sum(
+        prediction["response"] is not None for prediction in predictions
+    )
+    p50, p95, p99 = np.percentile(recorder.latencies, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "limiter": limiter is not None,
+        "seconds": elapsed,
+        "requests/sec": n_succeeded / elapsed,
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "retries": sum(recorder.statuses.values()) - len(examples),
+        "rate_limited": recorder.statuses[429],
+        "failed": len(examples) - n_succeeded,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.prompts_jsonl is not None:
+        examples = load_examples(args.prompts_jsonl)[: args.n_requests]
+    else:
+        examples = synthetic_examples(args.n_requests)
+    openai.api_key = "sk-fake"
+
+    print(
+        "concurrency limiter  seconds  requests/sec"
+        "    p50    p95    p99  retries    429  failed"
+    )
+    for concurrency, use_limiter in itertools.product(
+        args.concurrency, args.limiter
+    ):
+        # 設定ごとにサーバーを作り直し、直近60秒の窓を空にする
+        server = server_from_args(args)
+        limiter = (
+            RateLimiter(args.server_rpm, args.server_tpm)
+            if use_limiter
+            else None
+        )
+        result = await run_config(server, examples, concurrency, limiter)
+        print(
+            "{concurrency:>11} {limiter!s:>7} {seconds:>8.2f} "
+            "{requests/sec:>13.2f} {p50:>6.3f} {p95:>6.3f} {p99:>6.3f} "
+            "{retries:>8} {rate_limited:>6} {failed:>7}".format_map(result)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--prompts_jsonl",
+        type=Path,
+        help="use these prompts instead of synthetic ones",
+    )
+    parser.add_argument("--n_requests", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 5, 20]
+    )
+    parser.add_argument(
+        "--limiter",
+        type=lambda value: value == "on",
+        nargs="+",
+        default=[False],
+        metavar="{off,on}",
+        help="on: throttle on the client to --server_rpm/--server_tpm",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
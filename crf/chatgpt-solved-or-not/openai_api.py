@@ -1,16 +1,23 @@
 import argparse
 import asyncio
-from collections.abc import AsyncGenerator, AsyncIterable, Generator, Iterable
+import os
+from collections.abc import AsyncGenerator, Iterable
 from pathlib import Path
-from typing import TypedDict
 
 import backoff
 import jsonlines
 import openai
-from more_itertools import chunked
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
 
+from batch_api import (
+    BatchBackend,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    run_batch,
+)
 from custom_types import Example, Prediction
+from rate_limit import RateLimiter, estimate_tokens
+from response_cache import DEFAULT_MAX_BYTES, ResponseCache
 
 
 def load_examples(input_path: Path) -> list[Example]:
@@ -18,38 +25,102 @@ def load_examples(input_path: Path) -> list[Example]:
         return list(reader)
 
 
-def prompts_generator(
-    examples: Iterable[Example],
-) -> Generator[str, None, None]:
-    for example in examples:
-        yield example["prompt"]
+def load_done_ids(output_path: Path) -> set[str]:
+    """応答を得られたexampleのid（再開時はこれらをスキップし、失敗したものだけやり直す）"""
+    if not output_path.exists():
+        return set()
+    truncate_partial_line(output_path)
+    with jsonlines.open(output_path) as reader:
+        return {
+            prediction["id"]
+            for prediction in reader
+            if prediction["response"] is not None
+        }
+
 
+def truncate_partial_line(path: Path) -> None:
+    # 書き込み途中で落ちたときの末尾の不完全な行を捨てる
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
 
-class OpenAIResponse(TypedDict):
-    response: str
+
+def sort_predictions(output_path: Path, examples: list[Example]) -> int:
+    """出力をexamplesの順に並べ直し、失敗したもの（responseがNone）の数を返す
+
+    やり直して応答を得られたexampleは、後から書いた行を残す
+    """
+    with jsonlines.open(output_path) as reader:
+        predictions = {prediction["id"]: prediction for prediction in reader}
+    sorted_predictions = [
+        predictions[example["id"]]
+        for example in examples
+        if example["id"] in predictions
+    ]
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp")
+    with jsonlines.open(tmp_path, "w") as writer:
+        writer.write_all(sorted_predictions)
+    os.replace(tmp_path, output_path)
+    return sum(
+        prediction["response"] is None for prediction in sorted_predictions
+    )
 
 
 async def call_api(
-    propmts: Iterable[str],
-    chunk_size: int,
+    examples: Iterable[Example],
+    concurrency: int,
     model: str = "gpt-3.5-turbo-0301",
     temperature: float = 0.0,
-) -> AsyncGenerator[OpenAIResponse, None, None]:
-    for chunk in chunked(propmts, chunk_size):
-        coroutines = [
-            _single_call(prompt, model, temperature) for prompt in chunk
-        ]
-        results = await asyncio.gather(*coroutines, return_exceptions=True)
-        for result in results:
-            if isinstance(result, Exception):
-                print(repr(result))
-                yield {"response": None}
+    limiter: RateLimiter | None = None,
+    cache: ResponseCache | None = None,
+) -> AsyncGenerator[Prediction, None]:
+    """concurrency個のworkerが常にリクエストを送り続け、終わった順に返す
+
+    1つのリクエストが遅くても他のworkerは次のexampleに進む。失敗したときはresponseをNoneにする
+    """
+    examples_queue: asyncio.Queue[Example] = asyncio.Queue()
+    for example in examples:
+        examples_queue.put_nowait(example)
+    n_examples = examples_queue.qsize()
+    results_queue: asyncio.Queue[Prediction] = asyncio.Queue()
+
+    async def worker() -> None:
+        while not examples_queue.empty():
+            example = examples_queue.get_nowait()
+            try:
+                result = await _cached_call(
+                    example["prompt"], model, temperature, limiter, cache
+                )
+            except Exception as e:
+                print(example["id"], repr(e))
+                await results_queue.put(example | {"response": None})
             else:
-                yield {
-                    "response": result["choices"][0]["message"][
-                        "content"
-                    ].strip()
-                }
+                response = result["choices"][0]["message"]["content"].strip()
+                await results_queue.put(example | {"response": response})
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    for _ in range(n_examples):
+        yield await results_queue.get()
+    await asyncio.gather(*workers)
+
+
+async def _cached_call(
+    prompt: str,
+    model: str = "gpt-3.5-turbo-0301",
+    temperature: float = 0.0,
+    limiter: RateLimiter | None = None,
+    cache: ResponseCache | None = None,
+):
+    # キャッシュはリトライの外で1プロンプトにつき1回だけ引く（ヒット率を正しく数える）
+    if cache is not None:
+        cached = cache.get(model, temperature, prompt)
+        if cached is not None:
+            return cached
+    result = await _single_call(prompt, model, temperature, limiter)
+    if cache is not None:
+        cache.put(model, temperature, prompt, result)
+    return result
 
 
 @backoff.on_exception(
@@ -63,39 +134,144 @@ async def call_api(
     max_tries=3,
 )
 async def _single_call(
-    prompt: str, model: str = "gpt-3.5-turbo-0301", temperature: float = 0.0
+    prompt: str,
+    model: str = "gpt-3.5-turbo-0301",
+    temperature: float = 0.0,
+    limiter: RateLimiter | None = None,
 ):
-    return await openai.ChatCompletion.acreate(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=temperature,
-    )
+    if limiter is not None:
+        # 送る前に予算を確保する（リトライのときも改めて確保する）
+        await limiter.acquire(estimate_tokens(prompt))
+    try:
+        return await openai.ChatCompletion.acreate(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+        )
+    except openai.error.RateLimitError as e:
+        if limiter is not None:
+            limiter.record_rate_limited(e.headers)
+        raise
 
 
-async def response_added_example_generator(
-    examples: Iterable[Example], responses: AsyncIterable[OpenAIResponse]
-) -> AsyncGenerator[Prediction, None, None]:
-    examples_generator = (e for e in examples)
-    async for response in responses:
-        example = next(examples_generator)
-        yield example | response
-
+async def main(
+    input_path: Path,
+    output_path: Path,
+    concurrency: int,
+    limiter: RateLimiter | None = None,
+    cache: ResponseCache | None = None,
+):
+    all_examples = load_examples(input_path)
+    done_ids = load_done_ids(output_path)
+    examples = [e for e in all_examples if e["id"] not in done_ids]
+    print(f"Skip {len(done_ids)} examples already in {output_path}")
 
-async def main(input_path: Path, output_path: Path, chunk_size: int):
-    examples = load_examples(input_path)
-    responses = call_api(tqdm(prompts_generator(examples)), chunk_size)
-    with jsonlines.open(output_path, "w") as writer:
-        async for example in response_added_example_generator(
-            examples, responses
+    # 1件終わるごとに書き出すので、途中で落ちても再実行で続きから処理できる
+    # 失敗したものもresponse=Noneで書き、評価でexampleが抜け落ちないようにする
+    with jsonlines.open(output_path, "a", flush=True) as writer:
+        async for prediction in tqdm(
+            call_api(examples, concurrency, limiter=limiter, cache=cache),
+            total=len(examples),
         ):
-            writer.write(example)
+            writer.write(prediction)
+    report_failed(sort_predictions(output_path, all_examples))
+    if limiter is not None:
+        print(limiter.report())
+    if cache is not None:
+        print(cache.stats())
+
+
+def report_failed(n_failed: int) -> None:
+    if n_failed:
+        print(
+            f"{n_failed} requests failed (response is null). "
+            "Run again to retry them."
+        )
+
+
+def main_batch(
+    input_path: Path,
+    output_path: Path,
+    batch_dir: Path,
+    backend: BatchBackend,
+    poll_interval: float,
+    cache: ResponseCache | None = None,
+):
+    # mainと同じく、応答を得られたものは飛ばし、出力には追記する
+    all_examples = load_examples(input_path)
+    done_ids = load_done_ids(output_path)
+    examples = [e for e in all_examples if e["id"] not in done_ids]
+    print(f"Skip {len(done_ids)} examples already in {output_path}")
+    with jsonlines.open(output_path, "a", flush=True) as writer:
+        writer.write_all(
+            run_batch(
+                examples,
+                backend,
+                batch_dir,
+                poll_interval=poll_interval,
+                cache=cache,
+            )
+        )
+    report_failed(sort_predictions(output_path, all_examples))
+    if cache is not None:
+        print(cache.stats())
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("input_jsonl", type=Path)
     parser.add_argument("output_jsonl", type=Path)
-    parser.add_argument("--chunk_size", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--rpm", type=float, help="requests per minute")
+    parser.add_argument("--tpm", type=float, help="tokens per minute")
+    parser.add_argument(
+        "--cache", type=Path, help="SQLite file to cache responses in"
+    )
+    parser.add_argument(
+        "--cache_max_mb", type=int, default=DEFAULT_MAX_BYTES // 2**20
+    )
+    parser.add_argument(
+        "--batch_dir",
+        type=Path,
+        help="submit prompts offline via batch files written here",
+    )
+    parser.add_argument(
+        "--batch_backend", choices=["openai", "local"], default="openai"
+    )
+    parser.add_argument("--poll_interval", type=float, default=60.0)
     args = parser.parse_args()
 
-    asyncio.run(main(args.input_jsonl, args.output_jsonl, args.chunk_size))
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, args.cache_max_mb * 2**20)
+    try:
+        if args.batch_dir:
+            backends = {
+                "openai": OpenAIBatchBackend,
+                "local": LocalBatchBackend,
+            }
+            # バッチはレート制限の対象外なので、limiterは使わない
+            main_batch(
+                args.input_jsonl,
+                args.output_jsonl,
+                args.batch_dir,
+                backends[args.batch_backend](),
+                args.poll_interval,
+                cache,
+            )
+        else:
+            limiter = None
+            if args.rpm or args.tpm:
+                limiter = RateLimiter(args.rpm, args.tpm)
+            asyncio.run(
+                main(
+                    args.input_jsonl,
+                    args.output_jsonl,
+                    args.concurrency,
+                    limiter,
+                    cache,
+                )
+            )
+    finally:
+        if cache is not None:
+            cache.close()
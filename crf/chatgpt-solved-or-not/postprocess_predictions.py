@@ -1,12 +1,18 @@
 import argparse
 import ast
 import re
+from collections import defaultdict, deque
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
 
-import jsonlines
+import orjson
 
 from constants import ner_tags
-from custom_types import Prediction
+from custom_types import PackedPrediction, ParsedPrediction, Prediction
+from response_parser import scan_response
 
 verbose2short = {
     "Person": "PER",
@@ -82,24 +88,50 @@ def parse_response(response: str | None) -> list[list[str]]:
         return list(filter(lambda list_: len(list_) == 2, literal))
 
 
-def get_index(tokens: list[str], word: str) -> int:
-    """
-    >>> get_index(["their", "opening", "meeting", "against", "Syria"], "Syria")
-    4
-    >>> get_index(["their", "opening", "meeting", "against", "Syria"], "opening meeting")
-    1
+NUMBERED_LINE_PATTERN = re.compile(r"^\s*(\d+)\s*[:.)]\s*(.*)$")
+
+
+def split_packed_response(
+    response: str | None, n_sentences: int
+) -> list[str | None]:
+    r"""複数文をまとめたプロンプトへの応答を、文ごとの応答に分ける
+
+    番号のない行は直前の番号の文の続きとみなす。応答がない文はNone
+
+    >>> split_packed_response('1: ["Location", "JAPAN"]\n2: []', 2)
+    ['["Location", "JAPAN"]', '[]']
+    >>> split_packed_response('1: ["Person", "Nadim Ladki"]\n["Location", "AL-AIN"]\n3. []', 3)
+    ['["Person", "Nadim Ladki"]\n["Location", "AL-AIN"]', None, '[]']
+    >>> split_packed_response(None, 2)
+    [None, None]
     """
-    if len(word.split()) == 1:
-        return tokens.index(word)
-    else:  # len(word.split()) >= 2:
-        return tokens.index(word.split()[0])
+    if response is None:
+        return [None] * n_sentences
 
+    parts: list[list[str]] = [[] for _ in range(n_sentences)]
+    current = None
+    for line in response.splitlines():
+        if match := NUMBERED_LINE_PATTERN.match(line):
+            number = int(match.group(1))
+            current = number - 1 if 1 <= number <= n_sentences else None
+            line = match.group(2)
+        if current is not None and line.strip():
+            parts[current].append(line)
+    return ["\n".join(part) if part else None for part in parts]
 
-def is_in_tokens(word: str, tokens: list[str]) -> bool:
-    if len(word.split()) == 1:
-        return word in set(tokens)
-    else:
-        return set(word.split()) <= set(tokens)
+
+def ngram_positions(
+    tokens: list[str], n: int
+) -> dict[tuple[str, ...], list[int]]:
+    """tokensに現れるn-gram → 開始位置のリスト
+
+    >>> ngram_positions(["a", "b", "a", "b"], 2)
+    {('a', 'b'): [0, 2], ('b', 'a'): [1]}
+    """
+    positions = defaultdict(list)
+    for start in range(len(tokens) - n + 1):
+        positions[tuple(tokens[start : start + n])].append(start)
+    return dict(positions)
 
 
 def as_iob2_format(
@@ -123,58 +155,48 @@ def as_iob2_format(
     >>> as_iob2_format(["JAPAN"], [["Location", "Japan"]])
     ['O']
     """
-    # ChatGPTが指定した4つの固有表現タイプ以外も入れてくるので除く（例：Date）
-    only_four_types = filter(
-        lambda e: e[0] in verbose2short, recognized_entities
-    )
-    # ChatGPTがtokenのママ返さないときは除く（例：JAPANなのにJapanに変換して返す）
-    only_same_tokens = filter(
-        lambda e: is_in_tokens(e[1], tokens), only_four_types
-    )
-    recognized_entities = sorted(
-        only_same_tokens, key=lambda e: get_index(tokens, e[1])
-    )
-
-    iob2_tags = []
-    next_token_index = -1
-    recognition_index = 0
-    for index, token in enumerate(tokens):
-        if index < next_token_index:
-            continue
-        if recognition_index >= len(recognized_entities):
-            iob2_tags.append("O")
+    # 固有表現の語数ごとに、tokensのn-gram → 開始位置の索引を1度だけ作る
+    positions_by_length: dict[int, dict[tuple[str, ...], list[int]]] = {}
+    # (開始位置, 応答での順番, 語数, タイプ)
+    spans = []
+    for order, recognized_entity in enumerate(recognized_entities):
+        entity_type, entity = recognized_entity[:2]
+        # ChatGPTが指定した4つの固有表現タイプ以外も入れてくるので除く（例：Date）
+        if entity_type not in verbose2short:
             continue
+        words = tuple(entity.split(" "))
+        if len(words) not in positions_by_length:
+            positions_by_length[len(words)] = ngram_positions(
+                tokens, len(words)
+            )
+        # ChatGPTがtokenのママ返さないとき（例：JAPANなのにJapanに変換して返す）は見つからない
+        for start in positions_by_length[len(words)].get(words, []):
+            spans.append(
+                (start, order, len(words), verbose2short[entity_type])
+            )
 
-        recognized_entity = recognized_entities[recognition_index][1]
-        recognized_entity_type = recognized_entities[recognition_index][0]
-        entity_word_length = len(recognized_entity.split(" "))
-        if entity_word_length == 1:  # single word entity
-            if token != recognized_entity:
-                iob2_tags.append("O")
-                continue
-            # Case: token == recognized_entity
-            iob2_tags.append(f"B-{verbose2short[recognized_entity_type]}")
-            recognition_index += 1
+    # 前から順に、すでにタグを付けた範囲と重ならないものを採用する
+    iob2_tags = ["O"] * len(tokens)
+    next_token_index = 0
+    for start, _, length, short_type in sorted(spans):
+        if start < next_token_index:
             continue
-        else:  # multiple word entity
-            if (
-                " ".join(tokens[index : index + entity_word_length])
-                != recognized_entity
-            ):
-                iob2_tags.append("O")
-                continue
-            # Case: " ".join(tokens[index: index+entity_word_length]) == recognized_entity
-            iob2_tags.append(f"B-{verbose2short[recognized_entity_type]}")
-            for _ in range(entity_word_length - 1):
-                iob2_tags.append(f"I-{verbose2short[recognized_entity_type]}")
-            next_token_index = index + entity_word_length
-            recognition_index += 1
+        iob2_tags[start] = f"B-{short_type}"
+        iob2_tags[start + 1 : start + length] = [f"I-{short_type}"] * (
+            length - 1
+        )
+        next_token_index = start + length
     return iob2_tags
 
 
-def post_process(prediction: Prediction):
+ResponseParser = Callable[[str | None], list[list[str]]]
+
+
+def post_process(
+    prediction: Prediction, parse: ResponseParser = parse_response
+):
     try:
-        parsed_responses = parse_response(prediction["response"])
+        parsed_responses = parse(prediction["response"])
     except ValueError:
         return {"predicted_tags": [ner_tags["O"]] * len(prediction["tokens"])}
     else:
@@ -188,13 +210,143 @@ def post_process(prediction: Prediction):
         }
 
 
+def post_process_packed(
+    prediction: PackedPrediction, parse: ResponseParser = parse_response
+) -> Generator[ParsedPrediction, None, None]:
+    examples = prediction["examples"]
+    responses = split_packed_response(prediction["response"], len(examples))
+    for example, response in zip(examples, responses):
+        unpacked = Prediction(
+            **example, prompt=prediction["prompt"], response=response
+        )
+        yield unpacked | post_process(unpacked, parse)
+
+
+def post_process_records(
+    predictions: Iterable[Prediction | PackedPrediction],
+    parse: ResponseParser = parse_response,
+) -> Generator[ParsedPrediction, None, None]:
+    for prediction in predictions:
+        # 複数文をまとめたプロンプトは文ごとに分ける
+        if "examples" in prediction:
+            yield from post_process_packed(prediction, parse)
+        else:
+            yield prediction | post_process(prediction, parse)
+
+
+PARSERS = {"literal_eval": parse_response, "scan": scan_response}
+# ワーカープロセスに1度に渡す行数
+DEFAULT_CHUNK_SIZE = 256
+
+
+def post_process_lines(
+    lines: list[bytes], parse: ResponseParser = parse_response
+) -> bytes:
+    """JSONLの行のまとまりを後処理し、書き出すバイト列を返す（ワーカープロセスで実行する）"""
+    predictions = (orjson.loads(line) for line in lines if line.strip())
+    return b"".join(
+        orjson.dumps(parsed, option=orjson.OPT_APPEND_NEWLINE)
+        for parsed in post_process_records(predictions, parse)
+    )
+
+
+def read_chunks(
+    path: Path, chunk_size: int
+) -> Generator[list[bytes], None, None]:
+    with open(path, "rb") as f:
+        while chunk := list(islice(f, chunk_size)):
+            yield chunk
+
+
+def post_process_file(
+    input_path: Path,
+    output_path: Path,
+    parse: ResponseParser = parse_response,
+    executor: ProcessPoolExecutor | None = None,
+    max_pending: int = 8,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """chunk_size行ずつexecutorで後処理し、入力と同じ順に書き出す"""
+    process = partial(post_process_lines, parse=parse)
+    with open(output_path, "wb") as f:
+        if executor is None:
+            for chunk in read_chunks(input_path, chunk_size):
+                f.write(process(chunk))
+            return
+
+        pending = deque()
+        for chunk in read_chunks(input_path, chunk_size):
+            pending.append(executor.submit(process, chunk))
+            if len(pending) >= max_pending:
+                f.write(pending.popleft().result())
+        while pending:
+            f.write(pending.popleft().result())
+
+
+def post_process_files(
+    paths: list[tuple[Path, Path]],
+    parse: ResponseParser = parse_response,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """(入力, 出力)のパスの組をすべて後処理する。プロセスプールは全ファイルで使い回す"""
+    if workers <= 1:
+        for input_path, output_path in paths:
+            post_process_file(
+                input_path, output_path, parse, chunk_size=chunk_size
+            )
+            print(output_path)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        for input_path, output_path in paths:
+            post_process_file(
+                input_path,
+                output_path,
+                parse,
+                executor,
+                max_pending=workers * 2,
+                chunk_size=chunk_size,
+            )
+            print(output_path)
+
+
+def find_runs(
+    data_dir: Path, input_name: str, output_name: str
+) -> list[tuple[Path, Path]]:
+    """data_dir/<n>/input_nameを探し、同じディレクトリのoutput_nameと組にする"""
+    return [
+        (input_path, input_path.with_name(output_name))
+        for input_path in sorted(data_dir.glob(f"*/{input_name}"))
+    ]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("input_jsonl", type=Path)
-    parser.add_argument("output_jsonl", type=Path)
+    parser.add_argument(
+        "input",
+        type=Path,
+        help="prediction JSONL, or a directory containing <n>/input_name",
+    )
+    parser.add_argument("output_jsonl", type=Path, nargs="?")
+    parser.add_argument(
+        "--parser",
+        choices=PARSERS,
+        default="literal_eval",
+        help="scan: single-pass parser that keeps pairs found before prose",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--input_name", default="predictions.jsonl")
+    parser.add_argument("--output_name", default="parsed_predictions.jsonl")
     args = parser.parse_args()
 
-    with jsonlines.open(args.input_jsonl) as reader, jsonlines.open(
-        args.output_jsonl, "w"
-    ) as writer:
-        writer.write_all(obj | post_process(obj) for obj in reader)
+    if args.input.is_dir():
+        paths = find_runs(args.input, args.input_name, args.output_name)
+    elif args.output_jsonl is not None:
+        paths = [(args.input, args.output_jsonl)]
+    else:
+        parser.error("output_jsonl is required when input is a file")
+    post_process_files(
+        paths, PARSERS[args.parser], args.workers, args.chunk_size
+    )
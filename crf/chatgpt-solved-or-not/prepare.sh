@@ -1,9 +1,5 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
-for i in 1 2 3 4 5
-do
-  output_dir=data/${i}
-  mkdir -p ${output_dir}
-  python create_prompts.py ${output_dir}/prompts.jsonl --instruction_number ${i}
-done
+# data/1/prompts.jsonl 〜 data/5/prompts.jsonl を1回の実行で作る
+python create_all_prompts.py data
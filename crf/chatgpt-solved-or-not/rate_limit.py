@@ -0,0 +1,153 @@
+import asyncio
+import re
+import time
+from collections.abc import Callable, Mapping
+
+# 英語ではおよそ4文字で1トークン
+CHARS_PER_TOKEN = 4
+# 応答（["Type", "entity"]のリスト）のトークン数の見込み
+EXPECTED_COMPLETION_TOKENS = 30
+
+
+def estimate_tokens(
+    prompt: str, completion_tokens: int = EXPECTED_COMPLETION_TOKENS
+) -> int:
+    """
+    >>> estimate_tokens("a" * 400)
+    130
+    """
+    return len(prompt) // CHARS_PER_TOKEN + completion_tokens
+
+
+def parse_reset(value: str) -> float:
+    """x-ratelimit-reset-*ヘッダの値（例: 6m0s, 20ms, 1.5s）を秒にする
+
+    >>> parse_reset("6m0s")
+    360.0
+    >>> parse_reset("20ms")
+    0.02
+    >>> parse_reset("1.5s")
+    1.5
+    """
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(
+        float(number) * units[unit]
+        for number, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    )
+
+
+class TokenBucket:
+    """capacityまで貯まり、1秒あたりrefill_rateずつ回復するバケット"""
+
+    def __init__(
+        self,
+        capacity: float,
+        refill_rate: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.clock = clock
+        self.level = capacity
+        self.updated_at = clock()
+        self.blocked_until = 0.0
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.level = min(
+            self.capacity,
+            self.level + (now - self.updated_at) * self.refill_rate,
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        self.refill()
+        # capacityを超える要求も、満杯まで待てば通す
+        amount = min(amount, self.capacity)
+        blocked = max(0.0, self.blocked_until - self.clock())
+        shortage = max(0.0, amount - self.level)
+        return max(blocked, shortage / self.refill_rate)
+
+    def consume(self, amount: float) -> None:
+        self.refill()
+        self.level -= amount
+
+    def limit(self, remaining: float, reset_seconds: float | None) -> None:
+        """APIが返した残量でバケットを補正する"""
+        self.refill()
+        self.level = min(self.level, remaining)
+        if remaining <= 0 and reset_seconds is not None:
+            self.blocked_until = self.clock() + reset_seconds
+
+
+class RateLimiter:
+    """requests per minuteとtokens per minuteの両方の予算内でリクエストを送らせる
+
+    rpmかtpmがNoneのときは、その制限はかけない
+    """
+
+    def __init__(
+        self,
+        rpm: float | None,
+        tpm: float | None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.buckets = {
+            kind: TokenBucket(per_minute, per_minute / 60, clock)
+            for kind, per_minute in [("requests", rpm), ("tokens", tpm)]
+            if per_minute
+        }
+        self.clock = clock
+        # 待っているリクエストを先着順に通す（大きいリクエストが追い越され続けないように）
+        self.lock = asyncio.Lock()
+        self.started_at = clock()
+        self.n_requests = 0
+        self.n_tokens = 0
+        self.n_rate_limited = 0
+
+    async def acquire(self, tokens: int) -> None:
+        amounts = {"requests": 1, "tokens": tokens}
+        async with self.lock:
+            while (wait := self.wait_time(amounts)) > 0:
+                await asyncio.sleep(wait)
+            for kind, bucket in self.buckets.items():
+                bucket.consume(amounts[kind])
+            self.n_requests += 1
+            self.n_tokens += tokens
+
+    def wait_time(self, amounts: dict[str, float]) -> float:
+        return max(
+            (
+                bucket.wait_time(amounts[kind])
+                for kind, bucket in self.buckets.items()
+            ),
+            default=0.0,
+        )
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """レスポンス（429を含む）のx-ratelimit-*ヘッダに合わせて残量を減らす"""
+        headers = {k.lower(): v for k, v in headers.items()}
+        for kind, bucket in self.buckets.items():
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            reset = headers.get(f"x-ratelimit-reset-{kind}")
+            bucket.limit(
+                float(remaining), parse_reset(reset) if reset else None
+            )
+        if "retry-after" in headers:
+            retry_after = self.clock() + float(headers["retry-after"])
+            for bucket in self.buckets.values():
+                bucket.blocked_until = max(bucket.blocked_until, retry_after)
+
+    def record_rate_limited(self, headers: Mapping[str, str]) -> None:
+        self.n_rate_limited += 1
+        self.update_from_headers(headers)
+
+    def report(self) -> str:
+        minutes = max(self.clock() - self.started_at, 1e-9) / 60
+        return (
+            f"{self.n_requests / minutes:.1f} requests/min, "
+            f"{self.n_tokens / minutes:.0f} estimated tokens/min, "
+            f"{self.n_rate_limited} rate limited responses"
+        )
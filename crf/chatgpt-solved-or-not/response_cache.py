@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+class ResponseCache:
+    """(model, temperature, prompt) → APIのレスポンスを保存するSQLiteのキャッシュ
+
+    保存しているレスポンスの合計がmax_bytesを超えたら、最後に使われたのが古いものから消す
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS accessed_at_index"
+            " ON responses (accessed_at)"
+        )
+        (self.total_bytes,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, temperature: float, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"{model}:{temperature!r}:{prompt_hash}"
+
+    def get(self, model: str, temperature: float, prompt: str) -> dict | None:
+        key = self.key(model, temperature, prompt)
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(
+        self, model: str, temperature: float, prompt: str, response: dict
+    ) -> None:
+        key = self.key(model, temperature, prompt)
+        serialized = json.dumps(response, ensure_ascii=False)
+        size = len(serialized.encode("utf-8"))
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, serialized, size, time.time()),
+            )
+        self.total_bytes += size - (row[0] if row else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        evicted_keys = []
+        freed = 0
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        )
+        for key, size in rows:
+            if self.total_bytes - freed <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            freed += size
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM responses WHERE key = ?", evicted_keys
+            )
+        self.total_bytes -= freed
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"cache: {self.hits} hits, {self.misses} misses "
+            f"(hit rate {hit_rate:.1%}), {self.total_bytes} bytes stored"
+        )
+
+    def close(self) -> None:
+        self.connection.close()
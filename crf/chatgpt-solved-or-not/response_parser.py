@@ -0,0 +1,82 @@
+import re
+
+# 応答を字句に分ける。どの位置でもいずれかの選択肢にマッチするので、先頭から1度なめるだけでよい
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<open>\[)
+    |(?P<close>\])
+    |(?P<comma>,)
+    |(?P<space>\s+)
+    |"(?P<double>(?:[^"\\\n]|\\.)*)"
+    |'(?P<single>(?:[^'\\\n]|\\.)*)'(?=\s*[,\]])
+    |(?P<bare>(?:Location|Miscellaneous|Person|Organization)\b)
+    |(?P<other>[^\[\]",\s]+|")
+    """,
+    re.VERBOSE,
+)
+ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+# 状態: リストの外 / 要素の前（[か,の直後） / 要素の後
+OUTSIDE, BEFORE_ELEMENT, AFTER_ELEMENT = range(3)
+
+
+def scan_response(response: str | None) -> list[list[str]]:
+    r"""["Entity type", "Named entity"]の形のペアを先頭から1度だけなめて取り出す
+
+    parse_responseと違い、指示に従わない文章が混ざっていても例外にせず、取り出せたペアを返す
+
+    >>> scan_response('["Location", "JAPAN"]')
+    [['Location', 'JAPAN']]
+    >>> scan_response('["Location", "Syria"], ["Organization", "opening meeting"]')
+    [['Location', 'Syria'], ['Organization', 'opening meeting']]
+    >>> scan_response('["Location", "Syria"], ["[]"]')
+    [['Location', 'Syria']]
+    >>> scan_response('["Location", "JAPAN"]\n["Location", "CHINA"]\n[]')
+    [['Location', 'JAPAN'], ['Location', 'CHINA']]
+    >>> scan_response('[Location, "AL-AIN"], [Miscellaneous, "1996-12-06"]')
+    [['Location', 'AL-AIN'], ['Miscellaneous', '1996-12-06']]
+    >>> scan_response('["Location", "Syria"] (no Person entity is mentioned)')
+    [['Location', 'Syria']]
+    >>> scan_response('[] (no entity for "favourites")')
+    []
+    >>> scan_response('[["Person", "Takuya Takagi"], ["Location", "group C"]]')
+    [['Person', 'Takuya Takagi'], ['Location', 'group C']]
+    >>> scan_response(None)
+    []
+    >>> scan_response("[[], [], [], []]")
+    []
+    >>> scan_response("[['Person', \"O'Neill\"]] I don't see others.")
+    [['Person', "O'Neill"]]
+    >>> scan_response('["Person", "Say \\"Hi\\""]')
+    [['Person', 'Say "Hi"']]
+    """
+    if response is None:
+        return []
+
+    pairs = []
+    elements: list[str] = []
+    state = OUTSIDE
+    for match in TOKEN_PATTERN.finditer(response):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        if kind == "open":  # ネストしたリストも、内側の[からやり直せばよい
+            elements = []
+            state = BEFORE_ELEMENT
+        elif state == BEFORE_ELEMENT and kind in ("double", "single"):
+            elements.append(ESCAPE_PATTERN.sub(r"\1", match.group(kind)))
+            state = AFTER_ELEMENT
+        elif state == BEFORE_ELEMENT and kind == "bare":
+            elements.append(match.group(kind))
+            state = AFTER_ELEMENT
+        elif state == AFTER_ELEMENT and kind == "comma":
+            state = BEFORE_ELEMENT
+        elif state != OUTSIDE and kind == "close":
+            if len(elements) == 2:
+                pairs.append(elements)
+            elements = []
+            state = OUTSIDE
+        else:  # 文法に合わないトークンが来たら、作りかけのペアは捨てる
+            elements = []
+            state = OUTSIDE
+    return pairs
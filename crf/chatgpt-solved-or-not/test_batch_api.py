@@ -0,0 +1,263 @@
+import asyncio
+import doctest
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase
+
+import jsonlines
+
+import batch_api
+from batch_api import (
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    build_batch_requests,
+    collect_responses,
+    run_batch,
+    submit_batches,
+    wait_for_batches,
+    write_batch_files,
+)
+from fake_openai_server import FakeChatServer
+from openai_api import main_batch
+from response_cache import ResponseCache
+
+
+def make_examples(prompt_format: str, n: int = 5) -> list[dict]:
+    return [
+        {
+            "id": str(i),
+            "tokens": ["JAPAN"],
+            "ner_tags": [5],
+            "prompt": prompt_format.format(i),
+        }
+        for i in range(n)
+    ]
+
+
+def echo(prompt: str) -> str:
+    return f"response to {prompt}"
+
+
+class BatchApiTestCase(TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.work_dir = Path(temporary_directory.name)
+
+    def test_doctest(self):
+        self.assertEqual(doctest.testmod(batch_api).failed, 0)
+
+    def test_run_batch(self):
+        examples = make_examples("prompt {}")
+
+        predictions = list(
+            run_batch(examples, LocalBatchBackend(echo), self.work_dir)
+        )
+
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            [f"response to prompt {i}" for i in range(5)],
+        )
+
+    def test_rerun_with_different_input(self):
+        backend = LocalBatchBackend(echo)
+        list(run_batch(make_examples("prompt {}"), backend, self.work_dir))
+
+        predictions = list(
+            run_batch(
+                make_examples("another prompt {}"), backend, self.work_dir
+            )
+        )
+
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            [f"response to another prompt {i}" for i in range(5)],
+        )
+
+    def test_rerun_with_same_input_does_not_resubmit(self):
+        examples = make_examples("prompt {}")
+        list(run_batch(examples, LocalBatchBackend(echo), self.work_dir))
+
+        predictions = list(
+            run_batch(
+                examples,
+                LocalBatchBackend(lambda prompt: "new"),
+                self.work_dir,
+            )
+        )
+
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            [f"response to prompt {i}" for i in range(5)],
+        )
+
+    def test_failed_batch(self):
+        requests_ = build_batch_requests(
+            make_examples("prompt {}"), "gpt-3.5-turbo-0301", 0.0
+        )
+        input_paths = write_batch_files(
+            requests_, self.work_dir, max_requests=2
+        )
+        backend = LocalBatchBackend(
+            echo, fail=lambda path: path.name == "batch_input_1.jsonl"
+        )
+
+        batch_ids = submit_batches(backend, input_paths, self.work_dir)
+        wait_for_batches(backend, batch_ids, poll_interval=0.0)
+        responses = collect_responses(backend, batch_ids)
+
+        self.assertEqual(
+            {
+                custom_id: response["choices"][0]["message"]["content"]
+                for custom_id, response in responses.items()
+            },
+            {
+                "0": "response to prompt 0",
+                "1": "response to prompt 1",
+                "4": "response to prompt 4",
+            },
+        )
+
+    def test_openai_batch_without_output_file(self):
+        backend = OpenAIBatchBackend(api_key="sk-fake", api_base="http://x")
+        backend.batches["batch_0"] = {
+            "id": "batch_0",
+            "status": "expired",
+            "output_file_id": None,
+            "error_file_id": "file-0",
+        }
+
+        self.assertEqual(collect_responses(backend, ["batch_0"]), {})
+
+    def test_main_batch_skips_done_and_appends(self):
+        examples = make_examples("prompt {}")
+        input_path = self.work_dir / "input.jsonl"
+        output_path = self.work_dir / "output.jsonl"
+        with jsonlines.open(input_path, "w") as writer:
+            writer.write_all(examples)
+        with jsonlines.open(output_path, "w") as writer:
+            writer.write(examples[3] | {"response": "done before"})
+            writer.write(examples[1] | {"response": None})
+        cache = ResponseCache(self.work_dir / "cache.sqlite3")
+        self.addCleanup(cache.close)
+
+        main_batch(
+            input_path,
+            output_path,
+            self.work_dir / "batches",
+            LocalBatchBackend(echo),
+            poll_interval=0.0,
+            cache=cache,
+        )
+
+        with jsonlines.open(output_path) as reader:
+            predictions = list(reader)
+        self.assertEqual(
+            [prediction["id"] for prediction in predictions],
+            ["0", "1", "2", "3", "4"],
+        )
+        self.assertEqual(predictions[3]["response"], "done before")
+        self.assertEqual(predictions[1]["response"], "response to prompt 1")
+        # 飛ばしたもの以外の応答はキャッシュに入る
+        self.assertIsNone(cache.get("gpt-3.5-turbo-0301", 0.0, "prompt 3"))
+        self.assertIsNotNone(cache.get("gpt-3.5-turbo-0301", 0.0, "prompt 1"))
+
+    def test_run_batch_uses_cache(self):
+        examples = make_examples("prompt {}")
+        cache = ResponseCache(self.work_dir / "cache.sqlite3")
+        self.addCleanup(cache.close)
+        list(
+            run_batch(
+                examples[:3],
+                LocalBatchBackend(echo),
+                self.work_dir,
+                poll_interval=0.0,
+                cache=cache,
+            )
+        )
+        submitted = []
+
+        def respond(prompt: str) -> str:
+            submitted.append(prompt)
+            return "new"
+
+        predictions = list(
+            run_batch(
+                examples,
+                LocalBatchBackend(respond),
+                self.work_dir,
+                poll_interval=0.0,
+                cache=cache,
+            )
+        )
+
+        self.assertEqual(submitted, ["prompt 3", "prompt 4"])
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            [f"response to prompt {i}" for i in range(3)] + ["new", "new"],
+        )
+
+
+class OpenAIBatchBackendTestCase(TestCase):
+    """偽のサーバーのFiles API・Batch APIに対して、HTTPでバッチを投入する"""
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.work_dir = Path(temporary_directory.name)
+
+    def start_server(self, server: FakeChatServer) -> OpenAIBatchBackend:
+        # requestsは同期的に呼ぶので、サーバーは別スレッドのイベントループで動かす
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        runner, api_base = asyncio.run_coroutine_threadsafe(
+            server.start(), loop
+        ).result()
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        self.addCleanup(stop)
+        return OpenAIBatchBackend(api_key="sk-fake", api_base=api_base)
+
+    def test_run_batch(self):
+        backend = self.start_server(FakeChatServer(content=" [] "))
+
+        predictions = list(
+            run_batch(
+                make_examples("prompt {}"),
+                backend,
+                self.work_dir,
+                poll_interval=0.0,
+            )
+        )
+
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            ["[]"] * 5,
+        )
+
+    def test_failed_batch(self):
+        backend = self.start_server(FakeChatServer(batch_failure_rate=1.0))
+
+        predictions = list(
+            run_batch(
+                make_examples("prompt {}"),
+                backend,
+                self.work_dir,
+                poll_interval=0.0,
+            )
+        )
+
+        self.assertEqual(
+            [prediction["response"] for prediction in predictions],
+            [None] * 5,
+        )
+        (batch,) = backend.batches.values()
+        self.assertEqual(batch["status"], "failed")
+        self.assertIsNotNone(batch["error_file_id"])
@@ -0,0 +1,139 @@
+import doctest
+import random
+import string
+from unittest import TestCase
+
+from postprocess_predictions import as_iob2_format, verbose2short
+
+ENTITY_TYPES = [*verbose2short, "Date"]
+
+
+# 索引を使う前のas_iob2_format（各固有表現の最初の出現だけにタグを付ける）
+def get_index(tokens: list[str], word: str) -> int:
+    if len(word.split()) == 1:
+        return tokens.index(word)
+    else:  # len(word.split()) >= 2:
+        return tokens.index(word.split()[0])
+
+
+def is_in_tokens(word: str, tokens: list[str]) -> bool:
+    if len(word.split()) == 1:
+        return word in set(tokens)
+    else:
+        return set(word.split()) <= set(tokens)
+
+
+def legacy_as_iob2_format(
+    tokens: list[str], recognized_entities: list[list[str]]
+) -> list[str]:
+    # ChatGPTが指定した4つの固有表現タイプ以外も入れてくるので除く（例：Date）
+    only_four_types = filter(
+        lambda e: e[0] in verbose2short, recognized_entities
+    )
+    # ChatGPTがtokenのママ返さないときは除く（例：JAPANなのにJapanに変換して返す）
+    only_same_tokens = filter(
+        lambda e: is_in_tokens(e[1], tokens), only_four_types
+    )
+    recognized_entities = sorted(
+        only_same_tokens, key=lambda e: get_index(tokens, e[1])
+    )
+
+    iob2_tags = []
+    next_token_index = -1
+    recognition_index = 0
+    for index, token in enumerate(tokens):
+        if index < next_token_index:
+            continue
+        if recognition_index >= len(recognized_entities):
+            iob2_tags.append("O")
+            continue
+
+        recognized_entity = recognized_entities[recognition_index][1]
+        recognized_entity_type = recognized_entities[recognition_index][0]
+        entity_word_length = len(recognized_entity.split(" "))
+        if entity_word_length == 1:  # single word entity
+            if token != recognized_entity:
+                iob2_tags.append("O")
+                continue
+            # Case: token == recognized_entity
+            iob2_tags.append(f"B-{verbose2short[recognized_entity_type]}")
+            recognition_index += 1
+            continue
+        else:  # multiple word entity
+            if (
+                " ".join(tokens[index : index + entity_word_length])
+                != recognized_entity
+            ):
+                iob2_tags.append("O")
+                continue
+            # Case: " ".join(tokens[index: index+entity_word_length]) == recognized_entity
+            iob2_tags.append(f"B-{verbose2short[recognized_entity_type]}")
+            for _ in range(entity_word_length - 1):
+                iob2_tags.append(f"I-{verbose2short[recognized_entity_type]}")
+            next_token_index = index + entity_word_length
+            recognition_index += 1
+    return iob2_tags
+
+
+def random_case(rng: random.Random) -> tuple[list[str], list[list[str]]]:
+    """旧実装が正しく動く入力（トークンの重複なし、固有表現は重ならない）を作る"""
+    vocabulary = list(string.ascii_uppercase)
+    rng.shuffle(vocabulary)
+    tokens = vocabulary[: rng.randint(1, 20)]
+
+    entities = []
+    start = 0
+    while start < len(tokens):
+        start += rng.randint(0, 3)
+        length = rng.randint(1, 3)
+        if start + length > len(tokens):
+            break
+        words = tokens[start : start + length]
+        entities.append([rng.choice(ENTITY_TYPES), " ".join(words)])
+        start += length
+    # トークンにない固有表現（大文字小文字の違い）も混ぜる
+    if rng.random() < 0.3:
+        entities.append(["Location", rng.choice(tokens).lower()])
+    rng.shuffle(entities)
+    return tokens, entities
+
+
+class AsIob2FormatTestCase(TestCase):
+    def test_same_as_legacy_on_doctest_inputs(self):
+        (test,) = doctest.DocTestFinder().find(as_iob2_format)
+        for example in test.examples:
+            source = example.source.replace(
+                "as_iob2_format(", "legacy_as_iob2_format(", 1
+            )
+            with self.subTest(source=example.source):
+                self.assertEqual(
+                    eval(example.source, test.globs),
+                    eval(source, globals()),
+                )
+
+    def test_same_as_legacy_on_random_inputs(self):
+        rng = random.Random(0)
+        for _ in range(1000):
+            tokens, entities = random_case(rng)
+            with self.subTest(tokens=tokens, entities=entities):
+                self.assertEqual(
+                    as_iob2_format(tokens, entities),
+                    legacy_as_iob2_format(tokens, entities),
+                )
+
+    def test_repeated_mentions(self):
+        tokens = ["New", "York", "and", "New", "York", "Times"]
+        entities = [["Location", "New York"]]
+
+        self.assertEqual(
+            as_iob2_format(tokens, entities),
+            ["B-LOC", "I-LOC", "O", "B-LOC", "I-LOC", "O"],
+        )
+
+    def test_long_sentence(self):
+        tokens = [f"w{i}" for i in range(10_000)]
+        entities = [["Person", f"w{i} w{i + 1}"] for i in range(0, 10_000, 2)]
+
+        actual = as_iob2_format(tokens, entities)
+
+        self.assertEqual(actual[:4], ["B-PER", "I-PER", "B-PER", "I-PER"])
@@ -0,0 +1,76 @@
+import argparse
+import time
+from collections.abc import Callable
+
+import character_types
+import feature_engineering
+from character_types import get_character_type
+from corpus import CorpusReader, Sentence
+from feature_engineering import (
+    get_character_types,
+    sent2features,
+    word2features,
+)
+
+
+def legacy_get_character_types(string: str) -> str:
+    # 改善前の実装（1文字ずつ文字種を判定する。LRUキャッシュも表引きもなし）
+    types = map(get_character_type, string)
+    return "-".join(sorted(set(types)))
+
+
+def extract_without_reuse(sentences: list[Sentence]) -> list[list[list[str]]]:
+    # 改善前と同じく、窓に出てくるたびにトークンのFeatureを作り直す
+    return [
+        [word2features(sentence, i) for i in range(len(sentence))]
+        for sentence in sentences
+    ]
+
+
+def extract_with_reuse(sentences: list[Sentence]) -> list[list[list[str]]]:
+    return [sent2features(sentence) for sentence in sentences]
+
+
+def measure(
+    extract: Callable[[list[Sentence]], list[list[list[str]]]],
+    sentences: list[Sentence],
+    repeat: int,
+) -> tuple[float, list[list[list[str]]]]:
+    best = float("inf")
+    for _ in range(repeat):
+        # 前の実行で温まったLRUキャッシュを使わないようにする
+        get_character_types.cache_clear()
+        character_types.character_type_signature.cache_clear()
+        start = time.perf_counter()
+        features = extract(sentences)
+        best = min(best, time.perf_counter() - start)
+    return best, features
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="data/hironsan.txt")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    c = CorpusReader(args.corpus)
+    sentences = list(c.iob_sents("train")) + list(c.iob_sents("test"))
+
+    # 改善前の文字種判定に差し替えて測る
+    feature_engineering.get_character_types = legacy_get_character_types
+    try:
+        before, expected = measure(
+            extract_without_reuse, sentences, args.repeat
+        )
+    finally:
+        feature_engineering.get_character_types = get_character_types
+
+    after, actual = measure(extract_with_reuse, sentences, args.repeat)
+    assert actual == expected
+
+    n_tokens = sum(len(sentence) for sentence in sentences)
+    print(f"{len(sentences)} sentences, {n_tokens} tokens")
+    print(f"before (no reuse, per-character chain): {before:.3f} sec")
+    print(f"after  (reuse + table + LRU):           {after:.3f} sec")
+    print(f"speedup: {before / after:.2f}x")
+    print(get_character_types.cache_info())
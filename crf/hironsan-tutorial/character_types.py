@@ -0,0 +1,120 @@
+from enum import IntFlag
+from functools import lru_cache
+
+
+class CharacterType(IntFlag):
+    ZSPACE = 1 << 0
+    ZDIGIT = 1 << 1
+    ZLLET = 1 << 2
+    ZULET = 1 << 3
+    HIRAG = 1 << 4
+    KATAK = 1 << 5
+    OTHER = 1 << 6
+    # 以下は従来の文字種に追加で立つビット（従来の文字列表現には現れない）
+    KANJI = 1 << 7
+    FULLW = 1 << 8
+
+
+LEGACY_TYPES = (
+    CharacterType.ZSPACE
+    | CharacterType.ZDIGIT
+    | CharacterType.ZLLET
+    | CharacterType.ZULET
+    | CharacterType.HIRAG
+    | CharacterType.KATAK
+    | CharacterType.OTHER
+)
+
+KANJI_RANGES = [
+    (0x3005, 0x3007),  # 々〆〇
+    (0x3400, 0x4DBF),  # CJK統合漢字拡張A
+    (0x4E00, 0x9FFF),  # CJK統合漢字
+    (0xF900, 0xFAFF),  # CJK互換漢字
+    (0x20000, 0x3FFFF),  # CJK統合漢字拡張B以降
+]
+FULL_WIDTH_RANGE = (0xFF00, 0xFFEF)  # 全角英数・半角カナなど
+
+
+def is_hiragana(ch: str) -> bool:
+    return 0x3040 <= ord(ch) <= 0x309F
+
+
+def is_katakana(ch: str) -> bool:
+    return 0x30A0 <= ord(ch) <= 0x30FF
+
+
+def get_character_type(ch: str) -> str:
+    if ch.isspace():
+        return "ZSPACE"
+    elif ch.isdigit():
+        return "ZDIGIT"
+    elif ch.islower():
+        return "ZLLET"
+    elif ch.isupper():
+        return "ZULET"
+    elif is_hiragana(ch):
+        return "HIRAG"
+    elif is_katakana(ch):
+        return "KATAK"
+    else:
+        return "OTHER"
+
+
+def classify_character(ch: str) -> CharacterType:
+    """
+    >>> classify_character("漢")
+    <CharacterType.OTHER|KANJI: 192>
+    >>> classify_character("２")
+    <CharacterType.ZDIGIT|FULLW: 258>
+    """
+    code_point = ord(ch)
+    character_type = CharacterType[get_character_type(ch)]
+    if any(start <= code_point <= end for start, end in KANJI_RANGES):
+        character_type |= CharacterType.KANJI
+    if FULL_WIDTH_RANGE[0] <= code_point <= FULL_WIDTH_RANGE[1]:
+        character_type |= CharacterType.FULLW
+    return character_type
+
+
+# BMPの各コードポイント→文字種ビットの表（import時に1度だけ作る）
+BMP_TABLE = tuple(
+    int(classify_character(chr(code_point))) for code_point in range(0x10000)
+)
+
+# 従来の文字種ビットの組合せ（2**7通り）→ get_character_typesの文字列表現
+LEGACY_STRINGS = [
+    "-".join(
+        sorted(
+            character_type.name
+            for character_type in CharacterType
+            if character_type & LEGACY_TYPES & mask
+        )
+    )
+    for mask in range(LEGACY_TYPES + 1)
+]
+
+
+@lru_cache(maxsize=2**16)
+def character_type_signature(string: str) -> int:
+    """stringに含まれる文字種をビットの論理和で返す
+
+    >>> CharacterType(character_type_signature("東京タワー2005"))
+    <CharacterType.ZDIGIT|KATAK|OTHER|KANJI: 226>
+    """
+    # 文字列の重複除去（C実装の1パス）の後、異なり文字だけを表引きする
+    signature = 0
+    for ch in set(string):
+        code_point = ord(ch)
+        if code_point <= 0xFFFF:
+            signature |= BMP_TABLE[code_point]
+        else:  # BMP外の文字は表にないので個別に判定する
+            signature |= classify_character(ch)
+    return signature
+
+
+def signature_to_string(signature: int) -> str:
+    """
+    >>> signature_to_string(character_type_signature("東京タワー2005"))
+    'KATAK-OTHER-ZDIGIT'
+    """
+    return LEGACY_STRINGS[signature & LEGACY_TYPES]
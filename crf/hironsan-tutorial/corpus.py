@@ -1,30 +1,60 @@
 import codecs
 import csv
+import zlib
+from collections.abc import Generator, Iterable
 from typing import Literal
 
 MorphInfo = list[str]
 Sentence = list[MorphInfo]
 
+TEST_PERCENTAGE = 10
+
+
+def read_sentences(path) -> Generator[Sentence, None, None]:
+    with codecs.open(path, encoding="utf-8") as f:
+        all_morph_info = csv.reader(f, "excel-tab")
+        sentence: Sentence = []
+        for morph_info in all_morph_info:  # type: MorphInfo
+            if morph_info == []:  # 空行は文と文の間の区切り
+                yield sentence
+                sentence = []
+                continue
+            sentence.append(morph_info)
+
+
+def is_test_index(index: int) -> bool:
+    """文のindexのハッシュから、その文がtestに含まれるかを決める（文の総数を知らなくてよい）
+
+    >>> [i for i in range(30) if is_test_index(i)]
+    [6, 16, 27]
+    >>> sum(is_test_index(i) for i in range(10000))
+    956
+    """
+    return zlib.crc32(index.to_bytes(8, "little")) % 100 < TEST_PERCENTAGE
+
 
 class CorpusReader:
-    def __init__(self, path) -> None:
-        with codecs.open(path, encoding="utf-8") as f:
-            all_morph_info = csv.reader(f, "excel-tab")
-            sentence: Sentence = []
-            sentences: list[Sentence] = []
-            for morph_info in all_morph_info:  # type: MorphInfo
-                if morph_info == []:  # 空行は文と文の間の区切り
-                    sentences.append(sentence)
-                    sentence = []
-                    continue
-                sentence.append(morph_info)
+    def __init__(self, path, lazy: bool = False) -> None:
+        self.__path = path
+        self.__lazy = lazy
+        if lazy:  # 文はiob_sentsが呼ばれるたびにファイルから1文ずつ読み出す
+            return
+
+        sentences = list(read_sentences(path))
         train_num = int(len(sentences) * 0.9)
         self.__train_sents = sentences[:train_num]
         self.__test_sents = sentences[train_num:]
 
-    def iob_sents(self, name: Literal["train", "test"]) -> list[Sentence]:
+    def iob_sents(self, name: Literal["train", "test"]) -> Iterable[Sentence]:
+        if name not in {"train", "test"}:
+            raise ValueError
+        if self.__lazy:
+            return self.__iter_sents(name == "test")
         if name == "train":
             return self.__train_sents
-        if name == "test":
-            return self.__test_sents
-        raise ValueError
+        return self.__test_sents
+
+    def __iter_sents(self, test: bool) -> Generator[Sentence, None, None]:
+        for index, sentence in enumerate(read_sentences(self.__path)):
+            if is_test_index(index) == test:
+                yield sentence
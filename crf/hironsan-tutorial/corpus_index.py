@@ -0,0 +1,163 @@
+import argparse
+import csv
+import hashlib
+import mmap
+import random
+from array import array
+from collections.abc import Generator, Sequence
+from pathlib import Path
+from typing import Literal
+
+from corpus import Sentence, is_test_index
+
+# 先頭にコーパスのSHA-256（8バイトずつ4個）、続いて文の境界のバイトオフセット（文の数 + 1個）を並べる
+OFFSET_TYPECODE = "Q"
+HEADER_LENGTH = 4
+
+
+def index_path_of(corpus_path) -> Path:
+    return Path(f"{corpus_path}.idx")
+
+
+def build_index(corpus_path, index_path=None) -> Path:
+    """空行で区切られた文の境界のバイトオフセットをsidecarファイルに書き出す
+
+    i番目の文は corpus[offsets[i]:offsets[i + 1]] （区切りの空行を含む）
+    """
+    index_path = Path(index_path or index_path_of(corpus_path))
+    digest = hashlib.sha256()
+    offsets = array(OFFSET_TYPECODE, [0])
+    position = 0
+    with open(corpus_path, "rb") as f:
+        for line in f:
+            digest.update(line)
+            position += len(line)
+            if line.strip(b"\r\n") == b"":  # 空行は文と文の間の区切り
+                offsets.append(position)
+    with open(index_path, "wb") as f:
+        f.write(digest.digest())
+        offsets.tofile(f)
+    return index_path
+
+
+def hash_corpus(corpus_path) -> bytes:
+    with open(corpus_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").digest()
+
+
+def parse_sentence(data: bytes) -> Sentence:
+    rows = csv.reader(data.decode("utf-8").splitlines(), "excel-tab")
+    return [morph_info for morph_info in rows if morph_info != []]
+
+
+class IndexedCorpusReader(Sequence[Sentence]):
+    """コーパスとインデックスをmmapし、任意の文をO(1)で読み出す"""
+
+    def __init__(self, path, index_path=None) -> None:
+        index_path = Path(index_path or index_path_of(path))
+        # サイズが同じでも中身が変わっていればインデックスを作り直す
+        if not index_path.exists() or self.__indexed_digest(
+            index_path
+        ) != hash_corpus(path):
+            build_index(path, index_path)
+
+        with open(path, "rb") as f:
+            self.__corpus = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(index_path, "rb") as f:
+            self.__index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__header_and_offsets = memoryview(self.__index).cast(
+            OFFSET_TYPECODE
+        )
+        # 先頭のコーパスのハッシュを除いた残りが境界のオフセット
+        self.__offsets = self.__header_and_offsets[HEADER_LENGTH:]
+
+    @staticmethod
+    def __indexed_digest(index_path: Path) -> bytes:
+        with open(index_path, "rb") as f:
+            return f.read(HEADER_LENGTH * array(OFFSET_TYPECODE).itemsize)
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self.__offsets[index], self.__offsets[index + 1]
+        return parse_sentence(self.__corpus[start:end])
+
+    def sentence_indices(self, name: Literal["train", "test"]) -> list[int]:
+        if name not in {"train", "test"}:
+            raise ValueError
+        # CorpusReaderのlazyモードと同じ分割
+        return [
+            i for i in range(len(self)) if is_test_index(i) == (name == "test")
+        ]
+
+    def iob_sents(self, name: Literal["train", "test"]) -> "SentenceView":
+        return SentenceView(self, self.sentence_indices(name))
+
+    def shuffled_batches(
+        self, batch_size: int, seed: int = 0, indices: list[int] | None = None
+    ) -> Generator[list[Sentence], None, None]:
+        indices = list(range(len(self)) if indices is None else indices)
+        random.Random(seed).shuffle(indices)
+        for i in range(0, len(indices), batch_size):
+            yield [self[j] for j in indices[i : i + batch_size]]
+
+    def kfold(
+        self, k: int, seed: int | None = None
+    ) -> Generator[tuple["SentenceView", "SentenceView"], None, None]:
+        indices = list(range(len(self)))
+        if seed is not None:
+            random.Random(seed).shuffle(indices)
+        for fold in range(k):
+            test_indices = indices[fold::k]
+            test_set = set(test_indices)
+            train_indices = [i for i in indices if i not in test_set]
+            yield SentenceView(self, train_indices), SentenceView(
+                self, test_indices
+            )
+
+    def close(self) -> None:
+        self.__offsets.release()
+        self.__header_and_offsets.release()
+        self.__index.close()
+        self.__corpus.close()
+
+    def __enter__(self) -> "IndexedCorpusReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class SentenceView(Sequence[Sentence]):
+    """文のindexだけを持ち、アクセスされたときにコーパスから読み出す"""
+
+    def __init__(
+        self, reader: IndexedCorpusReader, indices: Sequence[int]
+    ) -> None:
+        self.reader = reader
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SentenceView(self.reader, self.indices[index])
+        return self.reader[self.indices[index]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", nargs="?", default="data/hironsan.txt")
+    args = parser.parse_args()
+
+    index_path = build_index(args.corpus)
+    with IndexedCorpusReader(args.corpus, index_path) as reader:
+        print(f"{len(reader)} sentences indexed into {index_path}")
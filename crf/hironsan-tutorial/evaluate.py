@@ -1,46 +1,211 @@
+import argparse
+from collections.abc import Iterable
 from itertools import chain
 
+import numpy as np
 import pycrfsuite
-from sklearn.metrics import classification_report
-from sklearn.preprocessing import LabelBinarizer
 
 from corpus import CorpusReader, Sentence
-from feature_engineering import create_X_y
+from feature_engineering import (
+    chunked,
+    create_X_y,
+    sent2features,
+    sent2labels,
+)
+from feature_store import load_or_create_X_y
+from tagging import tag_batches
 
 
 def sent2tokens(sentence: Sentence) -> list[str]:
     return [morph[0] for morph in sentence]
 
 
-def bio_classification_report(y_true, y_pred):
-    lb = LabelBinarizer()
-    y_true_combined = lb.fit_transform(list(chain.from_iterable(y_true)))
-    y_pred_combined = lb.transform(list(chain.from_iterable(y_pred)))
+class BIOReport:
+    """トークン単位のタグのP/R/F1を、ラベルをidにしたカウントだけで集計する
 
-    tagset = set(lb.classes_) - {"O"}
-    tagset = sorted(tagset, key=lambda tag: tag.split("-", 1)[::-1])
-    class_indices = {cls: idx for idx, cls in enumerate(lb.classes_)}
+    バッチごとにupdateでき、コーパス全体のラベル列をメモリに載せなくてよい
+    """
 
-    return classification_report(
-        y_true_combined,
-        y_pred_combined,
-        labels=[class_indices[cls] for cls in tagset],
-        target_names=tagset,
+    def __init__(self) -> None:
+        self.label2id: dict[str, int] = {}
+        self.true_counts = np.zeros(0, dtype=np.int64)
+        self.pred_counts = np.zeros(0, dtype=np.int64)
+        self.true_positives = np.zeros(0, dtype=np.int64)
+        self.n_tokens = 0
+
+    def encode(self, sequences: Iterable[list[str]]) -> np.ndarray:
+        label2id = self.label2id
+        return np.fromiter(
+            (
+                label2id.setdefault(label, len(label2id))
+                for label in chain.from_iterable(sequences)
+            ),
+            dtype=np.int64,
+        )
+
+    def update(
+        self, y_true: Iterable[list[str]], y_pred: Iterable[list[str]]
+    ) -> None:
+        true_ids = self.encode(y_true)
+        pred_ids = self.encode(y_pred)
+        n_labels = len(self.label2id)
+        self.true_counts = self.__add(
+            self.true_counts, np.bincount(true_ids, minlength=n_labels)
+        )
+        self.pred_counts = self.__add(
+            self.pred_counts, np.bincount(pred_ids, minlength=n_labels)
+        )
+        self.true_positives = self.__add(
+            self.true_positives,
+            np.bincount(true_ids[true_ids == pred_ids], minlength=n_labels),
+        )
+        self.n_tokens += len(true_ids)
+
+    @staticmethod
+    def __add(counts: np.ndarray, batch_counts: np.ndarray) -> np.ndarray:
+        # 新しいラベルが出てきたら、その分だけ配列を伸ばす
+        counts = np.pad(counts, (0, len(batch_counts) - len(counts)))
+        return counts + batch_counts
+
+    def report(self, output_dict: bool = False, digits: int = 2):
+        # 正解に出てこないラベルは対象外（LabelBinarizerを正解でfitしていたのと同じ）
+        tagset = [
+            label
+            for label, idx in self.label2id.items()
+            if label != "O" and self.true_counts[idx] > 0
+        ]
+        tagset = sorted(tagset, key=lambda tag: tag.split("-", 1)[::-1])
+        indices = [self.label2id[tag] for tag in tagset]
+        tp = self.true_positives[indices]
+        true = self.true_counts[indices]
+        pred = self.pred_counts[indices]
+
+        precision = _divide(tp, pred)
+        recall = _divide(tp, true)
+        f1 = _divide(2 * tp, true + pred)
+        rows = {
+            tag: _scores(p, r, f, s)
+            for tag, p, r, f, s in zip(tagset, precision, recall, f1, true)
+        }
+        support = true.sum()
+        averages = {
+            "micro avg": _scores(
+                *_divide(
+                    np.array([tp.sum(), tp.sum(), 2 * tp.sum()]),
+                    np.array([pred.sum(), support, pred.sum() + support]),
+                ),
+                support,
+            ),
+            "macro avg": _scores(
+                precision.mean(), recall.mean(), f1.mean(), support
+            ),
+            "weighted avg": _scores(
+                *(
+                    _divide((scores * true).sum(), support)
+                    for scores in (precision, recall, f1)
+                ),
+                support,
+            ),
+            # トークンごとの平均。正解・予測がともにtagsetのときだけ1点になる
+            "samples avg": _scores(
+                *[_divide(tp.sum(), self.n_tokens)] * 3, support
+            ),
+        }
+        if output_dict:
+            return rows | averages
+        return _format_report(rows, averages, digits)
+
+
+def _divide(numerator, denominator):
+    """0除算は0とする（sklearnのzero_division="warn"と同じ値）"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros_like(numerator),
+        where=denominator != 0,
     )
 
 
+def _scores(precision, recall, f1, support) -> dict[str, float]:
+    return {
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1-score": float(f1),
+        "support": int(support),
+    }
+
+
+def _format_report(rows, averages, digits: int) -> str:
+    # sklearn.metrics.classification_reportと同じ書式
+    headers = ["precision", "recall", "f1-score", "support"]
+    width = max(max(map(len, rows), default=0), len("weighted avg"), digits)
+    head_fmt = "{:>{width}s} " + " {:>9}" * len(headers)
+    report = head_fmt.format("", *headers, width=width) + "\n\n"
+    row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    for name, scores in rows.items():
+        report += row_fmt.format(
+            name, *scores.values(), width=width, digits=digits
+        )
+    report += "\n"
+    for name, scores in averages.items():
+        report += row_fmt.format(
+            name, *scores.values(), width=width, digits=digits
+        )
+    return report
+
+
+def bio_classification_report(y_true, y_pred, output_dict: bool = False):
+    bio_report = BIOReport()
+    bio_report.update(y_true, y_pred)
+    return bio_report.report(output_dict=output_dict)
+
+
 if __name__ == "__main__":
-    c = CorpusReader("data/hironsan.txt")
-    test_sents = c.iob_sents("test")
-    X_test, y_test = create_X_y(test_sents)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="data/hironsan.txt")
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument(
+        "--cache", action="store_true", help="reuse features in .feature_cache"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--chunk_size", type=int, default=256, help="sentences per update"
+    )
+    args = parser.parse_args()
+
+    if args.cache or args.workers > 1:
+        if args.cache:
+            X_test, y_test = load_or_create_X_y(
+                args.corpus, "test", args.lazy, args.workers
+            )
+        else:
+            c = CorpusReader(args.corpus, lazy=args.lazy)
+            X_test, y_test = create_X_y(c.iob_sents("test"), args.workers)
+        y_pairs = zip(
+            y_test, tag_batches("model.crfsuite", X_test, args.workers)
+        )
+    else:
+        tagger = pycrfsuite.Tagger()
+        tagger.open("model.crfsuite")
 
-    tagger = pycrfsuite.Tagger()
-    tagger.open("model.crfsuite")
+        c = CorpusReader(args.corpus, lazy=args.lazy)
+        test_sents = iter(c.iob_sents("test"))
 
-    example_sent = test_sents[0]
-    print(" ".join(sent2tokens(example_sent)))
-    print("Predicted:", " ".join(tagger.tag(X_test[0])))
-    print("Correct:  ", " ".join(y_test[0]))
+        example_sent = next(test_sents)
+        print(" ".join(sent2tokens(example_sent)))
+        # 1文ずつタグ付けし、ラベル列はchunkの分だけメモリに載せる
+        y_pairs = (
+            (sent2labels(sentence), tagger.tag(sent2features(sentence)))
+            for sentence in chain([example_sent], test_sents)
+        )
 
-    y_pred = [tagger.tag(xseq) for xseq in X_test]
-    print(bio_classification_report(y_test, y_pred))
+    report = BIOReport()
+    for i, chunk in enumerate(chunked(y_pairs, args.chunk_size)):
+        y_true_chunk, y_pred_chunk = zip(*chunk)
+        if i == 0:
+            print("Predicted:", " ".join(y_pred_chunk[0]))
+            print("Correct:  ", " ".join(y_true_chunk[0]))
+        report.update(y_true_chunk, y_pred_chunk)
+    print(report.report())
@@ -1,42 +1,27 @@
+from collections import deque
+from collections.abc import Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
 from typing import Literal, TypedDict
 
+from character_types import character_type_signature, signature_to_string
 from corpus import MorphInfo, Sentence
 
-
-def is_hiragana(ch: str) -> bool:
-    return 0x3040 <= ord(ch) <= 0x309F
-
-
-def is_katakana(ch: str) -> bool:
-    return 0x30A0 <= ord(ch) <= 0x30FF
-
-
-def get_character_type(ch: str) -> str:
-    if ch.isspace():
-        return "ZSPACE"
-    elif ch.isdigit():
-        return "ZDIGIT"
-    elif ch.islower():
-        return "ZLLET"
-    elif ch.isupper():
-        return "ZULET"
-    elif is_hiragana(ch):
-        return "HIRAG"
-    elif is_katakana(ch):
-        return "KATAK"
-    else:
-        return "OTHER"
+# 特徴量の作り方を変えたら上げる（feature_storeのキャッシュのキーに含まれる）
+FEATURE_VERSION = 1
 
 
+# コーパス全体で同じ単語が繰り返し出てくるので、単語→文字種の結果を使い回す
+@lru_cache(maxsize=2**16)
 def get_character_types(string: str) -> str:
     """stringがどんな文字種から構成されているかを返す
 
     >>> get_character_types("2005")
     'ZDIGIT'
     """
-    character_types = map(get_character_type, string)
-    return "-".join(sorted(set(character_types)))
+    return signature_to_string(character_type_signature(string))
 
 
 def extract_pos_with_subtype(morph: MorphInfo) -> str:
@@ -69,13 +54,27 @@ class FeatureFactory:
         )
 
 
+def create_token_features(sentence: Sentence) -> list[Feature]:
+    return [FeatureFactory(morph).create() for morph in sentence]
+
+
+def get_token_feature(
+    sentence: Sentence, token_features: list[Feature] | None, i: int
+) -> Feature:
+    if token_features is not None:
+        return token_features[i]
+    return FeatureFactory(sentence[i]).create()
+
+
 def create_nth_before_feature(
-    sentence: Sentence, i: int, n: Literal[1, 2]
+    sentence: Sentence,
+    i: int,
+    n: Literal[1, 2],
+    token_features: list[Feature] | None = None,
 ) -> list[str]:
     if i >= n:
         sentence_nth_before = sentence[i - n]
-        nth_before_factory = FeatureFactory(sentence_nth_before)
-        nth_before_feature = nth_before_factory.create()
+        nth_before_feature = get_token_feature(sentence, token_features, i - n)
         return [
             f"-{n}:word={nth_before_feature['word']}",
             f"-{n}:type={nth_before_feature['type']}",
@@ -87,12 +86,13 @@ def create_nth_before_feature(
 
 
 def create_nth_after_feature(
-    sentence: Sentence, i: int, n: Literal[1, 2]
+    sentence: Sentence,
+    i: int,
+    n: Literal[1, 2],
+    token_features: list[Feature] | None = None,
 ) -> list[str]:
     if i < len(sentence) - n:
-        sentence_nth_after = sentence[i + n]
-        nth_after_factory = FeatureFactory(sentence_nth_after)
-        nth_after_feature = nth_after_factory.create()
+        nth_after_feature = get_token_feature(sentence, token_features, i + n)
         return [
             f"+{n}:word={nth_after_feature['word']}",
             f"+{n}:type={nth_after_feature['type']}",
@@ -102,10 +102,11 @@ def create_nth_after_feature(
         return ["EOS"]
 
 
-def word2features(sentence: Sentence, i: int) -> list[str]:
-    sentence_i = sentence[i]
-    ith_factory = FeatureFactory(sentence_i)
-    ith_feature = ith_factory.create()
+def word2features(
+    sentence: Sentence, i: int, token_features: list[Feature] | None = None
+) -> list[str]:
+    """token_featuresを渡すと、前後の単語のFeatureを作り直さずに使い回す"""
+    ith_feature = get_token_feature(sentence, token_features, i)
     features = [
         "bias",
         f"word={ith_feature['word']}",
@@ -113,24 +114,63 @@ def word2features(sentence: Sentence, i: int) -> list[str]:
         f"postag={ith_feature['postag']}",
     ]
 
-    features.extend(create_nth_before_feature(sentence, i, 2))
-    features.extend(create_nth_before_feature(sentence, i, 1))
+    features.extend(create_nth_before_feature(sentence, i, 2, token_features))
+    features.extend(create_nth_before_feature(sentence, i, 1, token_features))
 
-    features.extend(create_nth_after_feature(sentence, i, 1))
-    features.extend(create_nth_after_feature(sentence, i, 2))
+    features.extend(create_nth_after_feature(sentence, i, 1, token_features))
+    features.extend(create_nth_after_feature(sentence, i, 2, token_features))
 
     return features
 
 
 def sent2features(sentence: Sentence) -> list[list[str]]:
-    return [word2features(sentence, i) for i in range(len(sentence))]
+    # 各トークンのFeatureは文ごとに1回だけ作る（前後2単語の窓で最大5回使われる）
+    token_features = create_token_features(sentence)
+    return [
+        word2features(sentence, i, token_features)
+        for i in range(len(sentence))
+    ]
 
 
 def sent2labels(sentence: Sentence) -> list[str]:
     return [morph[-1] for morph in sentence]
 
 
-def create_X_y(sentences: list[Sentence]):
+def create_X_y(sentences: Iterable[Sentence], workers: int = 1):
+    if workers > 1:
+        X, y = [], []
+        for X_chunk, y_chunk in iter_X_y_chunks(sentences, workers):
+            X.extend(X_chunk)
+            y.extend(y_chunk)
+        return X, y
+
+    sentences = list(sentences)
     X = [sent2features(s) for s in sentences]
     y = [sent2labels(s) for s in sentences]
     return X, y
+
+
+def chunked(
+    sentences: Iterable[Sentence], chunk_size: int
+) -> Generator[list[Sentence], None, None]:
+    iterator = iter(sentences)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def iter_X_y_chunks(
+    sentences: Iterable[Sentence], workers: int, chunk_size: int = 256
+) -> Generator[tuple[list[list[list[str]]], list[list[str]]], None, None]:
+    """文をchunk_sizeずつプロセスプールで特徴量にし、入力と同じ順に返す
+
+    chunkが終わり次第返すので、受け取り側（Trainer.appendなど）と特徴量抽出が並行する
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in chunked(sentences, chunk_size):
+            pending.append(executor.submit(create_X_y, chunk))
+            # 先行して投入するchunkの数を抑え、メモリに載る特徴量を一定にする
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import shutil
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Literal
+
+from corpus import CorpusReader
+from feature_engineering import FEATURE_VERSION, create_X_y
+
+X_y = tuple[list[list[list[str]]], list[list[str]]]
+
+DEFAULT_CACHE_DIR = Path(".feature_cache")
+
+
+def hash_file(path, chunk_size: int = 2**20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def feature_key(
+    corpus_path, name: Literal["train", "test"], lazy: bool = False
+) -> str:
+    """コーパスの中身・特徴量関数のバージョン・分割の仕方が同じなら同じキーになる"""
+    split = "hash" if lazy else "head90"
+    return f"{hash_file(corpus_path)[:16]}-v{FEATURE_VERSION}-{split}-{name}"
+
+
+class FeatureStore:
+    """特徴量文字列をidに置き換え、列ごとのバイナリファイルとして保存する
+
+    vocab.json / labels.json: id→文字列（JSONのリスト。特徴量に改行が含まれてもよい）
+    feature_ids.bin: 全トークンの特徴量idを連結したもの
+    token_offsets.bin: トークンiの特徴量は feature_ids[token_offsets[i]:token_offsets[i + 1]]
+    sentence_offsets.bin: 文jのトークンは sentence_offsets[j]:sentence_offsets[j + 1]
+    label_ids.bin: 全トークンのラベルid
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def save(self, key: str, X, y) -> Path:
+        vocab: dict[str, int] = {}
+        labels: dict[str, int] = {}
+        feature_ids = array("I")
+        token_offsets = array("Q", [0])
+        sentence_offsets = array("Q", [0])
+        label_ids = array("I")
+        for xseq, yseq in zip(X, y):
+            for features, label in zip(xseq, yseq):
+                feature_ids.extend(
+                    vocab.setdefault(feature, len(vocab))
+                    for feature in features
+                )
+                token_offsets.append(len(feature_ids))
+                label_ids.append(labels.setdefault(label, len(labels)))
+            sentence_offsets.append(len(label_ids))
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # 書き込み途中のものを読まないよう、一時ディレクトリに書いてからrenameする
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir))
+        for filename, strings in [
+            ("vocab.json", vocab),
+            ("labels.json", labels),
+        ]:
+            (tmp_dir / filename).write_text(
+                json.dumps(list(strings), ensure_ascii=False), "utf-8"
+            )
+        for filename, values in [
+            ("feature_ids.bin", feature_ids),
+            ("token_offsets.bin", token_offsets),
+            ("sentence_offsets.bin", sentence_offsets),
+            ("label_ids.bin", label_ids),
+        ]:
+            with open(tmp_dir / filename, "wb") as f:
+                values.tofile(f)
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        tmp_dir.rename(self.path(key))
+        return self.path(key)
+
+    def load(self, key: str) -> X_y | None:
+        path = self.path(key)
+        # vocab.txtで保存していた古い形式のものは作り直す
+        if not (path / "vocab.json").exists():
+            return None
+
+        vocab = json.loads((path / "vocab.json").read_text("utf-8"))
+        labels = json.loads((path / "labels.json").read_text("utf-8"))
+        feature_ids = read_array(path / "feature_ids.bin", "I")
+        token_offsets = read_array(path / "token_offsets.bin", "Q")
+        sentence_offsets = read_array(path / "sentence_offsets.bin", "Q")
+        label_ids = read_array(path / "label_ids.bin", "I")
+
+        token_features = [
+            list(map(vocab.__getitem__, feature_ids[start:end]))
+            for start, end in zip(token_offsets, token_offsets[1:])
+        ]
+        token_labels = list(map(labels.__getitem__, label_ids))
+        X, y = [], []
+        for start, end in zip(sentence_offsets, sentence_offsets[1:]):
+            X.append(token_features[start:end])
+            y.append(token_labels[start:end])
+        return X, y
+
+
+def read_array(path: Path, typecode: str) -> array:
+    values = array(typecode)
+    with open(path, "rb") as f:
+        values.frombytes(f.read())
+    return values
+
+
+def load_or_create_X_y(
+    corpus_path,
+    name: Literal["train", "test"],
+    lazy: bool = False,
+    workers: int = 1,
+    store: FeatureStore | None = None,
+) -> X_y:
+    store = store or FeatureStore()
+    key = feature_key(corpus_path, name, lazy)
+    if (cached := store.load(key)) is not None:
+        return cached
+
+    c = CorpusReader(corpus_path, lazy=lazy)
+    X, y = create_X_y(c.iob_sents(name), workers=workers)
+    store.save(key, X, y)
+    return X, y
@@ -0,0 +1,211 @@
+import argparse
+import csv
+import itertools
+import math
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import TypedDict
+
+import pycrfsuite
+
+from evaluate import bio_classification_report
+from feature_store import (
+    DEFAULT_CACHE_DIR,
+    FeatureStore,
+    feature_key,
+    load_or_create_X_y,
+)
+
+
+class CRFParams(TypedDict):
+    c1: float
+    c2: float
+    max_iterations: int
+
+
+class TrialResult(CRFParams):
+    precision: float
+    recall: float
+    f1_score: float
+    seconds: float
+
+
+def non_negative_float(value: str) -> float:
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0: {value}")
+    return number
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be > 0: {value}")
+    return number
+
+
+def grid_search(
+    c1s: list[float], c2s: list[float], max_iterations: list[int]
+) -> list[CRFParams]:
+    return [
+        CRFParams(c1=c1, c2=c2, max_iterations=n)
+        for c1, c2, n in itertools.product(c1s, c2s, max_iterations)
+    ]
+
+
+def random_search(
+    c1s: list[float],
+    c2s: list[float],
+    max_iterations: list[int],
+    n_trials: int,
+    seed: int = 0,
+) -> list[CRFParams]:
+    """c1, c2は指定された値の最小値〜最大値から対数一様にサンプリングする
+
+    0（正則化なし）は対数をとれないので、指定された値の1つとして別に選ぶ
+
+    >>> trials = random_search([0.0, 0.1, 1.0], [1e-3], [50], n_trials=100)
+    >>> sum(trial["c1"] == 0.0 for trial in trials)
+    33
+    >>> all(0.1 <= trial["c1"] <= 1.0 for trial in trials if trial["c1"])
+    True
+    """
+    rng = random.Random(seed)
+
+    def log_uniform(values: list[float]) -> float:
+        positives = [value for value in values if value > 0]
+        if len(positives) < len(values) and (
+            not positives or rng.random() < 1 / len(set(values))
+        ):
+            return 0.0
+        low, high = math.log(min(positives)), math.log(max(positives))
+        return math.exp(rng.uniform(low, high))
+
+    return [
+        CRFParams(
+            c1=log_uniform(c1s),
+            c2=log_uniform(c2s),
+            max_iterations=rng.choice(max_iterations),
+        )
+        for _ in range(n_trials)
+    ]
+
+
+# ワーカープロセスごとに1度だけfeature_storeから読み込む（タスクごとにpickleしない）
+_train: tuple | None = None
+_test: tuple | None = None
+
+
+def _init_worker(cache_dir: Path, train_key: str, test_key: str) -> None:
+    global _train, _test
+    store = FeatureStore(cache_dir)
+    _train = store.load(train_key)
+    _test = store.load(test_key)
+
+
+def run_trial(params: CRFParams) -> TrialResult:
+    start = time.perf_counter()
+    X_train, y_train = _train
+    X_test, y_test = _test
+
+    trainer = pycrfsuite.Trainer(verbose=False)
+    for xseq, yseq in zip(X_train, y_train):
+        trainer.append(xseq, yseq)
+    trainer.set_params(params | {"feature.possible_transitions": True})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = str(Path(tmp_dir) / "model.crfsuite")
+        trainer.train(model_path)
+        tagger = pycrfsuite.Tagger()
+        tagger.open(model_path)
+        y_pred = [tagger.tag(xseq) for xseq in X_test]
+        tagger.close()
+
+    report = bio_classification_report(y_test, y_pred, output_dict=True)
+    return TrialResult(
+        **params,
+        precision=report["micro avg"]["precision"],
+        recall=report["micro avg"]["recall"],
+        f1_score=report["micro avg"]["f1-score"],
+        seconds=time.perf_counter() - start,
+    )
+
+
+def sweep(
+    corpus_path,
+    trials: list[CRFParams],
+    workers: int,
+    lazy: bool = False,
+    cache_dir=DEFAULT_CACHE_DIR,
+) -> list[TrialResult]:
+    store = FeatureStore(cache_dir)
+    # 特徴量はここでディスクに保存しておき、各ワーカーはそれを読む
+    for name in ("train", "test"):
+        load_or_create_X_y(corpus_path, name, lazy, workers, store)
+    train_key = feature_key(corpus_path, "train", lazy)
+    test_key = feature_key(corpus_path, "test", lazy)
+
+    results = []
+    with ProcessPoolExecutor(
+        workers,
+        initializer=_init_worker,
+        initargs=(store.cache_dir, train_key, test_key),
+    ) as executor:
+        futures = [executor.submit(run_trial, params) for params in trials]
+        for future in as_completed(futures):
+            result = future.result()
+            print(result)
+            results.append(result)
+    return sorted(results, key=lambda r: r["f1_score"], reverse=True)
+
+
+def write_leaderboard(results: list[TrialResult], path: Path) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f, ["rank", *TrialResult.__annotations__], dialect="excel-tab"
+        )
+        writer.writeheader()
+        for rank, result in enumerate(results, start=1):
+            writer.writerow({"rank": rank} | result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="data/hironsan.txt")
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--n_trials", type=positive_int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--c1", type=non_negative_float, nargs="+", default=[0.01, 0.1, 1.0]
+    )
+    parser.add_argument(
+        "--c2",
+        type=non_negative_float,
+        nargs="+",
+        default=[1e-4, 1e-3, 1e-2],
+    )
+    parser.add_argument(
+        "--max_iterations", type=positive_int, nargs="+", default=[50]
+    )
+    parser.add_argument(
+        "--leaderboard", type=Path, default=Path("leaderboard.tsv")
+    )
+    args = parser.parse_args()
+
+    if args.search == "grid":
+        trials = grid_search(args.c1, args.c2, args.max_iterations)
+    else:
+        trials = random_search(
+            args.c1, args.c2, args.max_iterations, args.n_trials, args.seed
+        )
+    # 特徴量を作る前に、試す組合せがあることを確かめる
+    if not trials:
+        parser.error("no trials to run: check --c1, --c2 and --max_iterations")
+    results = sweep(args.corpus, trials, args.workers, args.lazy)
+    write_leaderboard(results, args.leaderboard)
+    print(f"Best: {results[0]}")
@@ -0,0 +1,89 @@
+import argparse
+import time
+from collections import deque
+from collections.abc import Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+import pycrfsuite
+
+from feature_engineering import chunked
+from feature_store import load_or_create_X_y
+
+XSeq = list[list[str]]
+
+# ワーカープロセスごとに1度だけモデルを開く
+_tagger: pycrfsuite.Tagger | None = None
+
+
+def _open_tagger(model_path: str) -> None:
+    global _tagger
+    _tagger = pycrfsuite.Tagger()
+    _tagger.open(model_path)
+
+
+def _tag_batch(batch: list[XSeq]) -> list[list[str]]:
+    return [_tagger.tag(xseq) for xseq in batch]
+
+
+def tag_batches(
+    model_path: str,
+    X: Iterable[XSeq],
+    workers: int = 1,
+    batch_size: int = 64,
+) -> Generator[list[str], None, None]:
+    """Xの各文をタグ付けし、入力と同じ順に返す"""
+    if workers <= 1:
+        _open_tagger(model_path)
+        for xseq in X:
+            yield _tagger.tag(xseq)
+        return
+
+    with ProcessPoolExecutor(
+        workers, initializer=_open_tagger, initargs=(model_path,)
+    ) as executor:
+        pending = deque()
+        for batch in chunked(X, batch_size):
+            pending.append(executor.submit(_tag_batch, batch))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def benchmark(
+    model_path: str, X: list[XSeq], workers: int, batch_size: int
+) -> dict[str, float]:
+    start = time.perf_counter()
+    for _ in tag_batches(model_path, X, workers, batch_size):
+        pass
+    elapsed = time.perf_counter() - start
+    n_tokens = sum(len(xseq) for xseq in X)
+    return {
+        "workers": workers,
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "sentences/sec": len(X) / elapsed,
+        "tokens/sec": n_tokens / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="model.crfsuite")
+    parser.add_argument("--corpus", default="data/hironsan.txt")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="tag the test set N times"
+    )
+    args = parser.parse_args()
+
+    X_test, _ = load_or_create_X_y(args.corpus, "test")
+    X_test = X_test * args.repeat
+    for workers in args.workers:
+        result = benchmark(args.model, X_test, workers, args.batch_size)
+        print(
+            "workers={workers} batch_size={batch_size}: "
+            "{sentences/sec:.1f} sentences/sec, "
+            "{tokens/sec:.1f} tokens/sec".format_map(result)
+        )
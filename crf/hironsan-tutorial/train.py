@@ -1,16 +1,41 @@
+import argparse
+
 import pycrfsuite
 
 from corpus import CorpusReader
-from feature_engineering import create_X_y
+from feature_engineering import iter_X_y_chunks, sent2features, sent2labels
+from feature_store import load_or_create_X_y
 
 if __name__ == "__main__":
-    c = CorpusReader("data/hironsan.txt")
-    train_sents = c.iob_sents("train")
-    X_train, y_train = create_X_y(train_sents)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="data/hironsan.txt")
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--cache", action="store_true", help="reuse features in .feature_cache"
+    )
+    args = parser.parse_args()
 
     trainer = pycrfsuite.Trainer(verbose=False)
-    for xseq, yseq in zip(X_train, y_train):
-        trainer.append(xseq, yseq)
+    if args.cache:
+        # キャッシュがあればコーパスは読まない
+        X_train, y_train = load_or_create_X_y(
+            args.corpus, "train", args.lazy, args.workers
+        )
+        for xseq, yseq in zip(X_train, y_train):
+            trainer.append(xseq, yseq)
+    elif args.workers > 1:
+        c = CorpusReader(args.corpus, lazy=args.lazy)
+        train_sents = c.iob_sents("train")
+        # プロセスプールで特徴量を作りながら、できたchunkから順にappendする
+        for X_chunk, y_chunk in iter_X_y_chunks(train_sents, args.workers):
+            for xseq, yseq in zip(X_chunk, y_chunk):
+                trainer.append(xseq, yseq)
+    else:
+        # 1文ずつ特徴量を作ってappendするので、lazyならコーパス全体を読み終える前に投入が始まる
+        c = CorpusReader(args.corpus, lazy=args.lazy)
+        for sentence in c.iob_sents("train"):
+            trainer.append(sent2features(sentence), sent2labels(sentence))
     trainer.set_params(
         {
             "c1": 1.0,
@@ -0,0 +1,100 @@
+import argparse
+import time
+
+from datasets import load_dataset
+
+from iob2_labels import output_labels, tokenize, tokenizer
+from label_ids import create_label2id
+from offset_labels import encode_with_offsets, label_batch
+
+
+def spacy_alignments_labels(
+    texts: list[str], entities_batch: list, label2id: dict[str, int]
+) -> list[list[int]]:
+    """iob2_labels.output_labels（spacy_alignments）で、preprocess_dataと同じラベルidを作る"""
+    labels = []
+    for text, entities in zip(texts, entities_batch):
+        tokens = tokenize(text, tokenizer)
+        string_labels = output_labels(text, tokens, entities)
+        labels.append(
+            [
+                -100 if label == "-" else label2id.get(label, 0)
+                for label in string_labels
+            ]
+        )
+    return labels
+
+
+def offset_labels(
+    texts: list[str],
+    entities_batch: list,
+    label2id: dict[str, int],
+    batch_size: int,
+) -> list[list[int]]:
+    labels = []
+    for start in range(0, len(texts), batch_size):
+        batch_texts = texts[start : start + batch_size]
+        encodings, offsets_batch = encode_with_offsets(batch_texts, tokenizer)
+        labels.extend(
+            label_batch(
+                offsets_batch,
+                [len(text) for text in batch_texts],
+                entities_batch[start : start + batch_size],
+                label2id,
+                encodings["special_tokens_mask"],
+            )
+        )
+    return labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--batch_size", type=int, default=1000)
+    args = parser.parse_args()
+
+    dataset = load_dataset("llm-book/ner-wikipedia-dataset")
+    label2id = create_label2id(dataset["train"]["entities"])
+    texts = dataset[args.split]["text"]
+    entities_batch = dataset[args.split]["entities"]
+
+    # どちらもトークナイズ（MeCab）の時間を含むので、それだけの時間も測っておく
+    start = time.perf_counter()
+    for i in range(0, len(texts), args.batch_size):
+        tokenizer(texts[i : i + args.batch_size])
+    tokenize_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = spacy_alignments_labels(texts, entities_batch, label2id)
+    spacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = offset_labels(texts, entities_batch, label2id, args.batch_size)
+    offset_seconds = time.perf_counter() - start
+
+    print(f"tokenizer only: {len(texts) / tokenize_seconds:.1f} texts/sec")
+    print(f"spacy_alignments: {len(texts) / spacy_seconds:.1f} texts/sec")
+    print(
+        f"offset_labels: {len(texts) / offset_seconds:.1f} texts/sec "
+        f"({spacy_seconds / offset_seconds:.1f}x)"
+    )
+    # トークナイズを除いた、ラベルを作る部分だけの時間
+    spacy_labeling = spacy_seconds - tokenize_seconds
+    offset_labeling = offset_seconds - tokenize_seconds
+    print(
+        f"labeling without tokenizer: spacy_alignments {spacy_labeling:.2f}s, "
+        f"offset_labels {offset_labeling:.2f}s "
+        f"({spacy_labeling / offset_labeling:.1f}x)"
+    )
+
+    # 違いは[UNK]を含む固有表現だけのはず（spacy_alignmentsではOになっていた）
+    unk_id = tokenizer.unk_token_id
+    n_different = n_different_with_unk = 0
+    for text, old, new in zip(texts, expected, actual):
+        if old != new:
+            n_different += 1
+            n_different_with_unk += unk_id in tokenizer.encode(text)
+    print(
+        f"{n_different} / {len(texts)} texts labeled differently "
+        f"({n_different_with_unk} of them contain [UNK])"
+    )
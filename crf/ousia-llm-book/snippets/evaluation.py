@@ -1,4 +1,5 @@
-from collections.abc import Iterable
+from collections import Counter
+from collections.abc import Generator, Iterable
 from typing import TypedDict
 
 from seqeval.metrics import classification_report
@@ -17,12 +18,11 @@ def create_character_labels(
     """
     labels = ["O"] * len(text)
     for entity in entities:
-        entity_span, entity_type = entity["span"], entity["type"]
+        (start, end), entity_type = entity["span"], entity["type"]
         # spanの開始の文字がB
-        labels[entity_span[0]] = f"B-{entity_type}"
-        # 開始の文字以外はI
-        for i in range(entity_span[0] + 1, entity_span[1]):
-            labels[i] = f"I-{entity_type}"
+        labels[start] = f"B-{entity_type}"
+        # 開始の文字以外はI（1文字ずつではなく、スライスでまとめて入れる）
+        labels[start + 1 : end] = [f"I-{entity_type}"] * (end - start - 1)
 
     return labels
 
@@ -89,6 +89,115 @@ def compute_scores(
     return {"precision": precision, "recall": recall, "f1_score": fscore}
 
 
+def iter_labels(
+    results: Iterable[Result],
+) -> Generator[tuple[list[str], list[str]], None, None]:
+    """seqevalに渡すための(正解, 予測)の文字ラベルを、1件ずつ必要になったときに作る
+
+    >>> results = [{"text": "大谷は", "entities": [{"name": "大谷", "span": [0, 2], "type": "人名"}], "pred_entities": []}]
+    >>> next(iter_labels(results))
+    (['B-人名', 'I-人名', 'O'], ['O', 'O', 'O'])
+    """
+    for result in results:
+        yield (
+            create_character_labels(result["text"], result["entities"]),
+            create_character_labels(result["text"], result["pred_entities"]),
+        )
+
+
+Span = tuple[int, int, str]
+
+
+def entity_spans(entities: Iterable[Entity]) -> set[Span]:
+    return {(*entity["span"], entity["type"]) for entity in entities}
+
+
+def count_spans(
+    results: Iterable[Result],
+) -> dict[str, tuple[int, int, int]]:
+    """固有表現タイプごとの(TP, FP, FN)を、(開始, 終了, タイプ)の集合の比較で数える"""
+    true_positives: Counter[str] = Counter()
+    false_positives: Counter[str] = Counter()
+    false_negatives: Counter[str] = Counter()
+    for result in results:
+        true_spans = entity_spans(result["entities"])
+        pred_spans = entity_spans(result["pred_entities"])
+        true_positives.update(t for _, _, t in true_spans & pred_spans)
+        false_positives.update(t for _, _, t in pred_spans - true_spans)
+        false_negatives.update(t for _, _, t in true_spans - pred_spans)
+    entity_types = sorted(true_positives | false_positives | false_negatives)
+    return {
+        entity_type: (
+            true_positives[entity_type],
+            false_positives[entity_type],
+            false_negatives[entity_type],
+        )
+        for entity_type in entity_types
+    }
+
+
+def compute_span_scores(results: Iterable[Result], average: str) -> Scores:
+    """文字ラベルを作らずにcompute_scoresと同じ値を求める（固有表現の範囲は重ならないものとする）
+
+    >>> results = [
+    ...   {
+    ...     "text": "大谷翔平は岩手県水沢市出身",
+    ...     "entities": [
+    ...       {"name": "大谷翔平", "span": [0, 4], "type": "人名"},
+    ...       {"name": "岩手県水沢市", "span": [5, 11], "type": "地名"},
+    ...     ],
+    ...     "pred_entities": [
+    ...       {"name": "大谷翔平", "span": [0, 4], "type": "人名"},
+    ...       {"name": "岩手県", "span": [5, 8], "type": "地名"},
+    ...       {"name": "水沢市", "span": [8, 11], "type": "施設名"},
+    ...     ],
+    ...   }
+    ... ]
+    >>> compute_span_scores(results, "micro")
+    {'precision': 0.3333333333333333, 'recall': 0.5, 'f1_score': 0.4}
+    >>> compute_span_scores(results, "macro")
+    {'precision': 0.3333333333333333, 'recall': 0.3333333333333333, 'f1_score': 0.3333333333333333}
+    """
+    counts = count_spans(results)
+    if average == "micro":
+        return _span_scores(
+            sum(tp for tp, _, _ in counts.values()),
+            sum(fp for _, fp, _ in counts.values()),
+            sum(fn for _, _, fn in counts.values()),
+        )
+
+    per_type = [_span_scores(*type_counts) for type_counts in counts.values()]
+    if average == "macro":
+        weights = [1] * len(per_type)
+    elif average == "weighted":
+        weights = [tp + fn for tp, _, fn in counts.values()]
+    else:
+        raise ValueError(
+            f"average must be micro, macro or weighted: {average}"
+        )
+    return {
+        metric: _divide(
+            sum(w * scores[metric] for w, scores in zip(weights, per_type)),
+            sum(weights),
+        )
+        for metric in ("precision", "recall", "f1_score")
+    }
+
+
+def _divide(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else 0.0
+
+
+def _span_scores(tp: int, fp: int, fn: int) -> Scores:
+    precision = _divide(tp, tp + fp)
+    recall = _divide(tp, tp + fn)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1_score": _divide(2 * precision * recall, precision + recall),
+    }
+
+
 if __name__ == "__main__":
     results = [
         Result(
@@ -110,3 +219,4 @@ if __name__ == "__main__":
     print(classification_report(true_labels, pred_labels))
 
     print(compute_scores(true_labels, pred_labels, "micro"))
+    print(compute_span_scores(results, "micro"))
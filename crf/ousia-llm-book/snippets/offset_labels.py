@@ -0,0 +1,267 @@
+import unicodedata
+from collections.abc import Iterable
+
+import numpy as np
+
+from data_types import Entity
+
+Offset = tuple[int, int]
+
+
+def token_offsets(
+    text: str,
+    tokens: list[str],
+    special_tokens_mask: list[int],
+    unk_token: str = "[UNK]",
+) -> list[Offset]:
+    """各トークンがtextの何文字目から何文字目か（fast tokenizerのoffset_mappingと同じ形）
+
+    cl-tohoku/bert-base-japanese-v3はfast tokenizerがなく、offset_mappingを返せない。
+    そこで、トークンをNFKC正規化したtextの先頭から順に探して位置を決め、元のtextの位置に戻す。
+    [UNK]や見つからないトークンは、次に見つかったトークンとの間の文字を割り当てる
+
+    >>> token_offsets("大谷翔平は", ["[CLS]", "大谷", "翔", "##平", "は", "[SEP]"], [1, 0, 0, 0, 0, 1])
+    [(0, 0), (0, 2), (2, 3), (3, 4), (4, 5), (0, 0)]
+    >>> token_offsets("矢吹怗一 監督", ["[CLS]", "矢", "##吹", "[UNK]", "監督", "[SEP]"], [1, 0, 0, 0, 0, 1])
+    [(0, 0), (0, 1), (1, 2), (2, 4), (5, 7), (0, 0)]
+    >>> token_offsets("ああいいうう", ["[CLS]", "ああ", "[UNK]", "[SEP]"], [1, 0, 0, 1])
+    [(0, 0), (0, 2), (2, 6), (0, 0)]
+    >>> token_offsets("（株）ＡＢＣ", ["[CLS]", "(", "株", ")", "ABC", "[SEP]"], [1, 0, 0, 0, 0, 1])
+    [(0, 0), (0, 1), (1, 2), (2, 3), (3, 6), (0, 0)]
+    """
+    normalized, char_starts, char_ends = _normalize_with_map(text)
+    offsets: list[Offset] = []
+    position = 0
+    # 位置がまだ決まっていないトークンのindexと、正規化したときの長さ（[UNK]はNone）
+    pending: list[int] = []
+    pending_lengths: list[int | None] = []
+    for index, (token, is_special) in enumerate(
+        zip(tokens, special_tokens_mask)
+    ):
+        if is_special:
+            offsets.append((0, 0))
+            continue
+        piece = unicodedata.normalize("NFKC", token.removeprefix("##"))
+        is_unk = token == unk_token
+        start = -1 if is_unk else normalized.find(piece, position)
+        # 間に空白以外の文字があるのは、位置の決まっていないトークンがあるときだけ
+        if start != -1 and not pending and normalized[position:start].strip():
+            start = -1
+        if start == -1:
+            pending.append(index)
+            pending_lengths.append(None if is_unk else len(piece))
+            offsets.append((position, position))
+            continue
+        if pending:
+            _assign_gap(
+                offsets, pending, pending_lengths, normalized, position, start
+            )
+            pending, pending_lengths = [], []
+        offsets.append((start, start + len(piece)))
+        position = start + len(piece)
+    if pending:
+        _assign_gap(
+            offsets,
+            pending,
+            pending_lengths,
+            normalized,
+            position,
+            len(normalized),
+        )
+    # 正規化したtextでの位置を、元のtextでの位置に戻す（特殊トークンの(0, 0)は(0, 0)のまま）
+    return [
+        (
+            char_starts[start],
+            char_ends[end - 1] if end > start else char_starts[start],
+        )
+        for start, end in offsets
+    ]
+
+
+def _normalize_with_map(text: str) -> tuple[str, list[int], list[int]]:
+    """1文字ずつNFKC正規化し、正規化後の各文字が元のtextの何文字目から何文字目かを返す
+
+    >>> _normalize_with_map("㈱Ａ")
+    ('(株)A', [0, 0, 0, 1, 2], [1, 1, 1, 2, 2])
+    """
+    characters: list[str] = []
+    char_starts: list[int] = []
+    char_ends: list[int] = []
+    for i, character in enumerate(text):
+        normalized = unicodedata.normalize("NFKC", character)
+        characters.append(normalized)
+        char_starts.extend([i] * len(normalized))
+        char_ends.extend([i + 1] * len(normalized))
+    # 末尾（長さ0のトークンの位置）
+    char_starts.append(len(text))
+    char_ends.append(len(text))
+    return "".join(characters), char_starts, char_ends
+
+
+def encode_with_offsets(texts: list[str], tokenizer) -> tuple[dict, list]:
+    """textsをまとめてトークナイズし、(encodings, 各テキストのトークンの文字位置)を返す
+
+    fast tokenizerならoffset_mappingを、そうでなければtoken_offsetsで求めたものを使う
+    """
+    encodings = tokenizer(
+        texts,
+        return_special_tokens_mask=True,
+        return_offsets_mapping=tokenizer.is_fast,
+    )
+    if tokenizer.is_fast:
+        return encodings, encodings.pop("offset_mapping")
+    offsets_batch = [
+        token_offsets(
+            text,
+            tokenizer.convert_ids_to_tokens(input_ids),
+            special_tokens_mask,
+            tokenizer.unk_token,
+        )
+        for text, input_ids, special_tokens_mask in zip(
+            texts, encodings["input_ids"], encodings["special_tokens_mask"]
+        )
+    ]
+    return encodings, offsets_batch
+
+
+def _assign_gap(
+    offsets: list[Offset],
+    pending: list[int],
+    lengths: list[int | None],
+    text: str,
+    start: int,
+    end: int,
+) -> None:
+    # 前から順に、長さのわかるトークンにはその長さを、[UNK]には後ろのトークンの分を残した残りを割り当てる
+    for i, (index, length) in enumerate(zip(pending, lengths)):
+        while start < end and text[start].isspace():
+            start += 1
+        if length is None:
+            rest = sum(other for other in lengths[i + 1 :] if other)
+            stop = max(end - rest, start)
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+        else:
+            stop = min(start + length, end)
+        offsets[index] = (start, stop)
+        start = stop
+
+
+def char_to_token_array(
+    offsets: list[Offset], n_characters: int
+) -> np.ndarray:
+    """何文字目が何番目のトークンか（どのトークンにも含まれない文字は-1）
+
+    >>> char_to_token_array([(0, 0), (0, 2), (2, 3), (4, 5), (0, 0)], 6)
+    array([ 1,  1,  2, -1,  3, -1])
+    """
+    offsets_array = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    lengths = offsets_array[:, 1] - offsets_array[:, 0]
+    token_indices = np.repeat(np.arange(len(offsets_array)), lengths)
+    # 各トークンの文字位置を、開始位置 + トークン内での位置 で並べる
+    char_indices = (
+        np.arange(lengths.sum())
+        - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        + np.repeat(offsets_array[:, 0], lengths)
+    )
+    char_to_token = np.full(n_characters, -1, dtype=np.int64)
+    char_to_token[char_indices] = token_indices
+    return char_to_token
+
+
+def label_batch(
+    offsets_batch: list[list[Offset]],
+    n_characters_batch: list[int],
+    entities_batch: list[list[Entity]],
+    label2id: dict[str, int],
+    special_tokens_mask_batch: list[list[int]],
+) -> list[list[int]]:
+    """バッチのすべてのテキストを1つにつないだ配列で、トークンごとのラベルidをまとめて作る
+
+    固有表現の最初の文字以降で最初のトークンをB、最後の文字以前で最後のトークンまでをIとする。
+    [UNK]にもoffsetがあるので、[UNK]を含む固有表現もOにならない
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2}
+    >>> offsets = [(0, 0), (0, 1), (1, 2), (2, 4), (4, 6), (0, 0)]  # 矢 ##吹 [UNK] 監督
+    >>> entities = [{"name": "矢吹怗一", "span": [0, 4], "type": "人名"}]
+    >>> label_batch([offsets, [(0, 0), (0, 2), (0, 0)]], [6, 2], [entities, []], label2id, [[1, 0, 0, 0, 0, 1], [1, 0, 1]])
+    [[-100, 1, 2, 2, 0, -100], [-100, 0, -100]]
+    """
+    n_tokens = np.array([len(offsets) for offsets in offsets_batch])
+    token_bases = np.cumsum(n_tokens) - n_tokens
+    char_bases = np.cumsum(n_characters_batch) - n_characters_batch
+    # テキストをつないだときの文字位置に、つないだときのトークン番号を対応させる
+    flat_offsets = np.concatenate(
+        [
+            np.asarray(offsets, dtype=np.int64).reshape(-1, 2) + char_base
+            for offsets, char_base in zip(offsets_batch, char_bases)
+        ]
+    )
+    char_to_token = char_to_token_array(flat_offsets, sum(n_characters_batch))
+
+    # 各文字について、その文字以前で最後のトークン・その文字以降で最初のトークン
+    n_all_tokens = len(flat_offsets)
+    previous_token = np.maximum.accumulate(char_to_token)
+    next_token = np.minimum.accumulate(
+        np.where(char_to_token >= 0, char_to_token, n_all_tokens)[::-1]
+    )[::-1]
+
+    starts, ends, b_ids, i_ids = [], [], [], []
+    for entities, char_base in zip(entities_batch, char_bases):
+        for entity in entities:
+            start, end = entity["span"]
+            starts.append(char_base + start)
+            ends.append(char_base + end)
+            # label2idにないタイプはOとする（preprocess_dataと同じ）
+            b_ids.append(label2id.get(f"B-{entity['type']}", label2id["O"]))
+            i_ids.append(label2id.get(f"I-{entity['type']}", label2id["O"]))
+
+    labels = np.full(n_all_tokens, label2id["O"], dtype=np.int64)
+    if starts:
+        first = next_token[np.array(starts)]
+        last = previous_token[np.array(ends) - 1]
+        # 固有表現の範囲にトークンがないもの（空白だけなど）は除く
+        found = first <= last
+        first, last = first[found], last[found]
+        lengths = last - first
+        inside = (
+            np.arange(lengths.sum())
+            - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            + np.repeat(first + 1, lengths)
+        )
+        labels[inside] = np.repeat(np.array(i_ids)[found], lengths)
+        labels[first] = np.array(b_ids)[found]
+
+    special = np.concatenate(
+        [np.asarray(mask, dtype=bool) for mask in special_tokens_mask_batch]
+    )
+    labels[special] = -100
+    return [
+        labels[base : base + n].tolist()
+        for base, n in zip(token_bases, n_tokens)
+    ]
+
+
+def label_ids_from_offsets(
+    offsets: list[Offset],
+    n_characters: int,
+    entities: Iterable[Entity],
+    label2id: dict[str, int],
+    special_tokens_mask: list[int],
+) -> list[int]:
+    """トークンの文字位置から、トークンごとのラベルidを作る（特殊トークンは-100）
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2}
+    >>> offsets = [(0, 0), (0, 2), (2, 3), (3, 4), (4, 5), (0, 0)]
+    >>> entities = [{"name": "大谷翔平", "span": [0, 4], "type": "人名"}]
+    >>> label_ids_from_offsets(offsets, 5, entities, label2id, [1, 0, 0, 0, 0, 1])
+    [-100, 1, 2, 2, 0, -100]
+    """
+    (labels,) = label_batch(
+        [offsets],
+        [n_characters],
+        [list(entities)],
+        label2id,
+        [special_tokens_mask],
+    )
+    return labels
@@ -1,12 +1,15 @@
+from pathlib import Path
 from typing import TypedDict, cast
 
 import torch
-from datasets import load_dataset
+from datasets import Dataset, Features, Sequence, Value, load_dataset
+from datasets.fingerprint import Hasher
 from transformers import AutoTokenizer, PreTrainedTokenizer
 from transformers.tokenization_utils_base import BatchEncoding
 
 from data_types import Entity
 from iob2_labels import output_labels, tokenize
+from offset_labels import encode_with_offsets, label_batch
 
 model_name = "cl-tohoku/bert-base-japanese-v3"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -49,19 +52,100 @@ def preprocess_data(
     return flatten_inputs
 
 
+# 前処理の中身を変えたら上げる（キャッシュを作り直させる）
+PREPROCESS_VERSION = 1
+DEFAULT_CACHE_DIR = Path(".preprocess_cache")
+# torch.Tensorにせず、Arrowの整数の列のまま持つ
+ENCODED_FEATURES = Features(
+    {
+        "input_ids": Sequence(Value("int32")),
+        "token_type_ids": Sequence(Value("int8")),
+        "special_tokens_mask": Sequence(Value("int8")),
+        "attention_mask": Sequence(Value("int8")),
+        "labels": Sequence(Value("int16")),
+    }
+)
+
+
+def preprocess_batch(
+    batch: dict[str, list],
+    tokenizer: PreTrainedTokenizer,
+    label2id: dict[str, int],
+) -> dict[str, list[list[int]]]:
+    """dataset.map(batched=True)用。バッチのテキストをまとめて1度だけトークナイズする
+
+    ラベルはトークンの文字位置（offset）から作る。
+    fast tokenizerでなければoffset_mappingがないので、トークン列から求める
+    """
+    encodings, offsets_batch = encode_with_offsets(batch["text"], tokenizer)
+    labels = label_batch(
+        offsets_batch,
+        [len(text) for text in batch["text"]],
+        batch["entities"],
+        label2id,
+        encodings["special_tokens_mask"],
+    )
+    return {
+        "input_ids": encodings["input_ids"],
+        "token_type_ids": encodings["token_type_ids"],
+        "special_tokens_mask": encodings["special_tokens_mask"],
+        "attention_mask": encodings["attention_mask"],
+        "labels": labels,
+    }
+
+
+def tokenizer_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    """tokenizerの設定と語彙のハッシュ
+
+    新しいdatasets（5.1で確認）のHasher.hashは、MeCabを使うtokenizer（BertJapaneseTokenizer）を
+    __getstate__を通さずにpickleしようとして失敗する
+    """
+    return Hasher.hash(
+        [
+            type(tokenizer).__name__,
+            tokenizer.init_kwargs,
+            tokenizer.get_vocab(),
+        ]
+    )
+
+
+def preprocess_dataset(
+    dataset: Dataset,
+    tokenizer: PreTrainedTokenizer,
+    label2id: dict[str, int],
+    cache_dir: Path = DEFAULT_CACHE_DIR,
+    batch_size: int = 1000,
+) -> Dataset:
+    """前処理した結果を、tokenizerとデータセットのfingerprintをキーにキャッシュする"""
+    fingerprint = Hasher.hash(
+        [
+            dataset._fingerprint,
+            tokenizer_fingerprint(tokenizer),
+            label2id,
+            PREPROCESS_VERSION,
+        ]
+    )
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return dataset.map(
+        preprocess_batch,
+        batched=True,
+        batch_size=batch_size,
+        fn_kwargs={"tokenizer": tokenizer, "label2id": label2id},
+        remove_columns=dataset.column_names,
+        features=ENCODED_FEATURES,
+        cache_file_name=str(cache_dir / f"{fingerprint}.arrow"),
+        new_fingerprint=fingerprint,
+    )
+
+
 if __name__ == "__main__":
     from label_ids import create_label2id
 
     dataset = load_dataset("llm-book/ner-wikipedia-dataset")
     label2id = create_label2id(dataset["train"]["entities"])
 
-    train_dataset = dataset["train"].map(
-        preprocess_data,
-        fn_kwargs={"tokenizer": tokenizer, "label2id": label2id},
-        remove_columns=dataset["train"].column_names,
-    )
-    validation_dataset = dataset["validation"].map(
-        preprocess_data,
-        fn_kwargs={"tokenizer": tokenizer, "label2id": label2id},
-        remove_columns=dataset["validation"].column_names,
+    # 学習時にwith_format("torch")でテンソルとして取り出す
+    train_dataset = preprocess_dataset(dataset["train"], tokenizer, label2id)
+    validation_dataset = preprocess_dataset(
+        dataset["validation"], tokenizer, label2id
     )
@@ -0,0 +1,38 @@
+import doctest
+from unittest import TestCase
+
+import evaluation
+from evaluation import (
+    compute_scores,
+    compute_span_scores,
+    convert_results_to_labels,
+)
+
+
+class ComputeSpanScoresTestCase(TestCase):
+    def test_doctest(self):
+        self.assertEqual(doctest.testmod(evaluation).failed, 0)
+
+    def test_no_entities(self):
+        results = [
+            {"text": "今日は晴れ", "entities": [], "pred_entities": []},
+        ]
+        zeros = {"precision": 0.0, "recall": 0.0, "f1_score": 0.0}
+
+        for average in ("micro", "macro", "weighted"):
+            with self.subTest(average=average):
+                self.assertEqual(compute_span_scores(results, average), zeros)
+
+    def test_no_entities_same_as_compute_scores(self):
+        results = [
+            {"text": "今日は晴れ", "entities": [], "pred_entities": []},
+        ]
+        true_labels, pred_labels = convert_results_to_labels(results)
+
+        # macroはseqevalだとnanになるので、micro, weightedだけ比べる
+        for average in ("micro", "weighted"):
+            with self.subTest(average=average):
+                self.assertEqual(
+                    compute_span_scores(results, average),
+                    compute_scores(true_labels, pred_labels, average),
+                )
@@ -0,0 +1,49 @@
+import doctest
+from unittest import TestCase
+
+import offset_labels
+from offset_labels import label_ids_from_offsets, token_offsets
+
+
+class TokenOffsetsTestCase(TestCase):
+    def test_doctest(self):
+        self.assertEqual(doctest.testmod(offset_labels).failed, 0)
+
+    def test_consecutive_normalized_tokens(self):
+        # MeCabはNFKC正規化したトークンを返す
+        text = "（株）ＡＢＣの社長"
+        tokens = ["[CLS]", "(", "株", ")", "ABC", "の", "社長", "[SEP]"]
+        special_tokens_mask = [1, 0, 0, 0, 0, 0, 0, 1]
+
+        offsets = token_offsets(text, tokens, special_tokens_mask)
+
+        self.assertEqual(
+            offsets,
+            [(0, 0), (0, 1), (1, 2), (2, 3), (3, 6), (6, 7), (7, 9), (0, 0)],
+        )
+        label2id = {"O": 0, "B-法人名": 1, "I-法人名": 2}
+        entities = [{"name": "ＡＢＣ", "span": [3, 6], "type": "法人名"}]
+        self.assertEqual(
+            label_ids_from_offsets(
+                offsets, len(text), entities, label2id, special_tokens_mask
+            ),
+            [-100, 0, 0, 0, 1, 0, 0, -100],
+        )
+
+    def test_character_normalized_to_several(self):
+        text = "㈱ＡＢＣ"
+        tokens = ["[CLS]", "(", "株", ")", "ABC", "[SEP]"]
+
+        offsets = token_offsets(text, tokens, [1, 0, 0, 0, 0, 1])
+
+        self.assertEqual(
+            offsets, [(0, 0), (0, 1), (0, 1), (0, 1), (1, 4), (0, 0)]
+        )
+
+    def test_unknown_between_normalized_tokens(self):
+        text = "ＡＢ怗ＣＤ"
+        tokens = ["[CLS]", "AB", "[UNK]", "CD", "[SEP]"]
+
+        offsets = token_offsets(text, tokens, [1, 0, 0, 0, 1])
+
+        self.assertEqual(offsets, [(0, 0), (0, 2), (2, 3), (3, 5), (0, 0)])
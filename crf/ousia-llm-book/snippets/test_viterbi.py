@@ -0,0 +1,118 @@
+import doctest
+from unittest import TestCase
+
+import torch
+
+import viterbi
+from transitions import create_transitions
+from viterbi import (
+    FORBIDDEN,
+    naive_viterbi_decode,
+    sparse_viterbi_decode,
+    sparsify_transitions,
+    viterbi_decode,
+)
+
+
+def bio_label2id(n_types: int) -> dict[str, int]:
+    label2id = {"O": 0}
+    for i in range(n_types):
+        label2id[f"B-{i}"] = i * 2 + 1
+        label2id[f"I-{i}"] = i * 2 + 2
+    return label2id
+
+
+def random_batch(
+    generator: torch.Generator,
+    n_labels: int,
+    n_sequences: int = 16,
+    max_length: int = 12,
+    scale: float = 1.0,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    emissions = scale * torch.randn(
+        n_sequences, max_length, n_labels, generator=generator
+    )
+    lengths = torch.randint(
+        1, max_length + 1, (n_sequences,), generator=generator
+    )
+    mask = torch.arange(max_length) < lengths.unsqueeze(1)
+    return emissions, mask
+
+
+class SparseViterbiDecodeTestCase(TestCase):
+    def setUp(self):
+        self.generator = torch.Generator().manual_seed(0)
+
+    def test_doctest(self):
+        self.assertEqual(doctest.testmod(viterbi).failed, 0)
+
+    def assert_same_paths(self, emissions, mask, st, t, et):
+        expected = viterbi_decode(emissions, mask, st, t, et)
+        self.assertEqual(
+            sparse_viterbi_decode(
+                emissions, mask, st, sparsify_transitions(t), et
+            ),
+            expected,
+        )
+        return expected
+
+    def test_same_as_dense(self):
+        st, t, et = create_transitions(bio_label2id(3))
+
+        for scale in (1.0, 100.0, 1000.0):
+            with self.subTest(scale=scale):
+                emissions, mask = random_batch(
+                    self.generator, len(t), scale=scale
+                )
+                self.assert_same_paths(emissions, mask, st, t, et)
+
+    def test_forbidden_transitions_outweighed_by_emissions(self):
+        # Iの前がOでも、emissionsの差がFORBIDDENより大きければIを選ぶ
+        st, t, et = create_transitions(bio_label2id(1))
+        emissions = torch.tensor([[[150.0, 0.0, 0.0], [0.0, 0.0, 500.0]]])
+
+        paths = self.assert_same_paths(
+            emissions, torch.tensor([[1, 1]]), st, t, et
+        )
+
+        self.assertEqual(paths, [[0, 2]])
+
+    def test_ties(self):
+        # 同点のときは、前のラベルの番号が小さいほうを選ぶ
+        st, t, et = create_transitions(bio_label2id(2))
+        emissions = torch.randint(
+            0, 2, (16, 6, len(t)), generator=self.generator
+        ).float()
+        mask = torch.ones(16, 6, dtype=torch.bool)
+
+        paths = self.assert_same_paths(emissions, mask, st, t, et)
+
+        self.assertEqual(
+            naive_viterbi_decode(emissions, mask, st, t, et), paths
+        )
+
+    def test_label_without_incoming_edges(self):
+        st, t, et = create_transitions(bio_label2id(2))
+        # I-1にはどのラベルからも遷移できない
+        t[:, 4] = FORBIDDEN
+
+        for scale in (1.0, 1000.0):
+            with self.subTest(scale=scale):
+                emissions, mask = random_batch(
+                    self.generator, len(t), scale=scale
+                )
+                self.assert_same_paths(emissions, mask, st, t, et)
+
+    def test_all_transitions_forbidden(self):
+        st, _, et = create_transitions(bio_label2id(1))
+        t = torch.full((3, 3), FORBIDDEN)
+        emissions, mask = random_batch(self.generator, 3)
+
+        self.assert_same_paths(emissions, mask, st, t, et)
+
+    def test_reject_transitions_below_forbidden(self):
+        _, t, _ = create_transitions(bio_label2id(1))
+        t[0, 2] = FORBIDDEN - 1
+
+        with self.assertRaises(ValueError):
+            sparsify_transitions(t)
@@ -0,0 +1,338 @@
+import argparse
+import time
+from typing import NamedTuple
+
+import torch
+
+from transitions import create_transitions
+
+# create_transitionsで遷移できないラベルの組に入れている値
+FORBIDDEN = -100.0
+
+
+def viterbi_decode(
+    emissions: torch.Tensor,
+    mask: torch.Tensor,
+    start_transitions: torch.Tensor,
+    transitions: torch.Tensor,
+    end_transitions: torch.Tensor,
+) -> list[list[int]]:
+    """パディングしたバッチ（emissionsは[バッチ, 系列長, ラベル数]）の最尤のラベル列を求める
+
+    maskはattention_mask（各系列の先頭は1であること）。
+    各時刻で「前のラベル × 今のラベル」のスコアをバッチまとめて計算する
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2}
+    >>> st, t, et = create_transitions(label2id)
+    >>> emissions = torch.tensor([[[0.0, 0.0, 5.0], [0.0, 0.0, 5.0]], [[0.0, 0.0, 5.0], [9.0, 9.0, 9.0]]])
+    >>> viterbi_decode(emissions, torch.tensor([[1, 1], [1, 0]]), st, t, et)
+    [[1, 2], [0]]
+    """
+    mask = mask.bool()
+    batch_size, seq_length, _ = emissions.shape
+    score = start_transitions + emissions[:, 0]
+    history = []
+    for t in range(1, seq_length):
+        # [バッチ, 前のラベル, 今のラベル]
+        next_score = (
+            score.unsqueeze(2)
+            + transitions.unsqueeze(0)
+            + emissions[:, t].unsqueeze(1)
+        )
+        next_score, indices = next_score.max(dim=1)
+        score = torch.where(mask[:, t].unsqueeze(1), next_score, score)
+        history.append(indices)
+    score = score + end_transitions
+    return _backtrack(score.argmax(dim=1), history, mask)
+
+
+def _backtrack(
+    best_last_labels: torch.Tensor,
+    history: list[torch.Tensor],
+    mask: torch.Tensor,
+) -> list[list[int]]:
+    """各系列の最後から、記録した直前のラベルをバッチまとめてたどる"""
+    batch_size, seq_length = mask.shape
+    lengths = mask.sum(dim=1)
+    labels = torch.zeros(batch_size, seq_length, dtype=torch.long)
+    current = best_last_labels
+    for t in range(seq_length - 1, 0, -1):
+        # 系列の長さを超えた時刻は、最後のラベルのまま動かさない
+        in_sequence = t < lengths
+        labels[:, t] = current
+        previous = history[t - 1].gather(1, current.unsqueeze(1)).squeeze(1)
+        current = torch.where(in_sequence, previous, current)
+    labels[:, 0] = current
+    return [
+        sequence[:length].tolist()
+        for sequence, length in zip(labels, lengths.tolist())
+    ]
+
+
+class SparseTransitions(NamedTuple):
+    """遷移できるラベルの組（辺）だけを並べたもの
+
+    遷移のスコアの列（前のラベル全体）が同じラベルは1つのグループにまとめる。
+    BIOでは、OとすべてのBが1グループ、各Iが同じタイプのB, Iからの2辺だけのグループになる
+    """
+
+    edge_previous: torch.Tensor  # [辺の数] 辺の前のラベル
+    edge_group: torch.Tensor  # [辺の数] 辺の行き先のグループ
+    edge_scores: torch.Tensor  # [辺の数] 辺の遷移スコア
+    label_group: torch.Tensor  # [ラベル数] 各ラベルのグループ
+    n_groups: int
+    forbidden: float  # 辺のない組の遷移スコア
+
+
+def sparsify_transitions(
+    transitions: torch.Tensor, forbidden: float = FORBIDDEN
+) -> SparseTransitions:
+    """forbiddenより大きいスコアの組を辺とする（それ以外はforbiddenちょうどであること）
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2, "B-組織名": 3, "I-組織名": 4}
+    >>> _, t, _ = create_transitions(label2id)
+    >>> sparse = sparsify_transitions(t)
+    >>> sparse.n_groups, len(sparse.edge_previous)
+    (3, 9)
+    >>> sparsify_transitions(t - 1)
+    Traceback (most recent call last):
+      ...
+    ValueError: transitions must be greater than or equal to -100.0
+    """
+    if (transitions < forbidden).any():
+        raise ValueError(
+            f"transitions must be greater than or equal to {forbidden}"
+        )
+    # 遷移できない組は-infにして、同じ列をまとめる
+    columns = torch.where(
+        transitions > forbidden, transitions, torch.tensor(float("-inf"))
+    ).T
+    unique_columns, label_group = torch.unique(
+        columns, dim=0, return_inverse=True
+    )
+    edge_group, edge_previous = torch.nonzero(
+        unique_columns > float("-inf"), as_tuple=True
+    )
+    return SparseTransitions(
+        edge_previous=edge_previous,
+        edge_group=edge_group,
+        edge_scores=unique_columns[edge_group, edge_previous],
+        label_group=label_group,
+        n_groups=len(unique_columns),
+        forbidden=forbidden,
+    )
+
+
+def sparse_viterbi_decode(
+    emissions: torch.Tensor,
+    mask: torch.Tensor,
+    start_transitions: torch.Tensor,
+    sparse: SparseTransitions,
+    end_transitions: torch.Tensor,
+) -> list[list[int]]:
+    """遷移できるラベルの組だけを計算して、viterbi_decodeと同じラベル列を求める
+
+    辺のない組の候補は、前のラベルのスコアの最大 + forbiddenで代表させる。
+    その前のラベルに辺があれば辺の候補のほうがスコアが大きいので、
+    各グループで辺の最大とこれの大きいほうをとれば、すべての組を調べたのと一致する
+    （同点のときは前のラベルの番号が小さいほう）
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2}
+    >>> st, t, et = create_transitions(label2id)
+    >>> emissions = torch.tensor([[[0.0, 0.0, 5.0], [0.0, 0.0, 5.0]], [[0.0, 0.0, 5.0], [9.0, 9.0, 9.0]]])
+    >>> sparse_viterbi_decode(emissions, torch.tensor([[1, 1], [1, 0]]), st, sparsify_transitions(t), et)
+    [[1, 2], [0]]
+    >>> emissions = torch.tensor([[[0.0, 0.0, 500.0], [0.0, 0.0, 500.0]]])
+    >>> sparse_viterbi_decode(emissions, torch.tensor([[1, 1]]), st, sparsify_transitions(t), et)
+    [[2, 2]]
+    """
+    mask = mask.bool()
+    batch_size, seq_length, _ = emissions.shape
+    n_edges = len(sparse.edge_previous)
+    edge_indices = torch.arange(n_edges).expand(batch_size, n_edges)
+    group_index = sparse.edge_group.expand(batch_size, n_edges)
+    # 辺のないグループのbest_edgeはn_edgesになるので、その分を足しておく
+    edge_previous = torch.cat(
+        [sparse.edge_previous, sparse.edge_previous.new_zeros(1)]
+    )
+    score = start_transitions + emissions[:, 0]
+    history = []
+    for t in range(1, seq_length):
+        # [バッチ, 辺の数]
+        edge_score = score[:, sparse.edge_previous] + sparse.edge_scores
+        group_score = torch.full(
+            (batch_size, sparse.n_groups), float("-inf")
+        ).scatter_reduce(
+            1, group_index, edge_score, reduce="amax", include_self=False
+        )
+        # 最大値をとる辺のうち、番号の最も小さいもの（辺は前のラベルの順に並ぶ）
+        is_best = edge_score == group_score.gather(1, group_index)
+        best_edge = torch.full(
+            (batch_size, sparse.n_groups), n_edges
+        ).scatter_reduce(
+            1,
+            group_index,
+            torch.where(is_best, edge_indices, n_edges),
+            reduce="amin",
+            include_self=False,
+        )
+        group_previous = edge_previous[best_edge]
+        # [バッチ, 1] 辺のない組の候補の最大と、それをとる最も小さい前のラベル
+        forbidden_score = score + sparse.forbidden
+        best_forbidden = forbidden_score.amax(dim=1, keepdim=True)
+        forbidden_previous = (
+            (forbidden_score == best_forbidden)
+            .int()
+            .argmax(dim=1, keepdim=True)
+        )
+        use_forbidden = (best_forbidden > group_score) | (
+            (best_forbidden == group_score)
+            & (forbidden_previous < group_previous)
+        )
+        group_score = torch.where(use_forbidden, best_forbidden, group_score)
+        group_previous = torch.where(
+            use_forbidden, forbidden_previous, group_previous
+        )
+        indices = group_previous[:, sparse.label_group]
+        next_score = group_score[:, sparse.label_group] + emissions[:, t]
+        score = torch.where(mask[:, t].unsqueeze(1), next_score, score)
+        history.append(indices)
+    score = score + end_transitions
+    return _backtrack(score.argmax(dim=1), history, mask)
+
+
+def naive_viterbi_decode(
+    emissions: torch.Tensor,
+    mask: torch.Tensor,
+    start_transitions: torch.Tensor,
+    transitions: torch.Tensor,
+    end_transitions: torch.Tensor,
+) -> list[list[int]]:
+    """比較用。1系列ずつ、時刻と今のラベルについてPythonでループする"""
+    results = []
+    for sequence_emissions, length in zip(emissions, mask.sum(dim=1).tolist()):
+        score = (start_transitions + sequence_emissions[0]).tolist()
+        history = []
+        for t in range(1, length):
+            next_score, indices = [], []
+            for label in range(len(score)):
+                candidates = [
+                    score[previous] + transitions[previous, label].item()
+                    for previous in range(len(score))
+                ]
+                best = max(range(len(score)), key=candidates.__getitem__)
+                next_score.append(
+                    candidates[best] + sequence_emissions[t, label].item()
+                )
+                indices.append(best)
+            score = next_score
+            history.append(indices)
+        final = [s + e for s, e in zip(score, end_transitions.tolist())]
+        labels = [max(range(len(final)), key=final.__getitem__)]
+        for indices in reversed(history):
+            labels.append(indices[labels[-1]])
+        results.append(labels[::-1])
+    return results
+
+
+def path_scores(
+    emissions: torch.Tensor,
+    start_transitions: torch.Tensor,
+    transitions: torch.Tensor,
+    end_transitions: torch.Tensor,
+    paths: list[list[int]],
+) -> torch.Tensor:
+    """各系列のラベル列のスコア（Viterbiで最大化している値）をfloat64で求める
+
+    >>> label2id = {"O": 0, "B-人名": 1, "I-人名": 2}
+    >>> st, t, et = create_transitions(label2id)
+    >>> emissions = torch.tensor([[[0.0, 0.0, 5.0], [0.0, 0.0, 5.0]], [[0.0, 0.0, 5.0], [9.0, 9.0, 9.0]]])
+    >>> path_scores(emissions, st, t, et, [[1, 2], [0]])
+    tensor([5., 0.], dtype=torch.float64)
+    """
+    start_transitions = start_transitions.double()
+    transitions = transitions.double()
+    end_transitions = end_transitions.double()
+    scores = []
+    for sequence_emissions, path in zip(emissions.double(), paths):
+        labels = torch.tensor(path)
+        scores.append(
+            start_transitions[labels[0]]
+            + sequence_emissions[torch.arange(len(labels)), labels].sum()
+            + transitions[labels[:-1], labels[1:]].sum()
+            + end_transitions[labels[-1]]
+        )
+    return torch.stack(scores)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_sequences", type=int, default=128)
+    parser.add_argument("--max_length", type=int, default=128)
+    # ner-wikipedia-datasetは8タイプ（ラベル数17）
+    parser.add_argument("--n_types", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    label2id = {"O": 0}
+    for i in range(args.n_types):
+        label2id[f"B-{i}"] = i * 2 + 1
+        label2id[f"I-{i}"] = i * 2 + 2
+    start_transitions, transitions, end_transitions = create_transitions(
+        label2id
+    )
+    sparse = sparsify_transitions(transitions)
+
+    generator = torch.Generator().manual_seed(args.seed)
+    emissions = torch.randn(
+        args.n_sequences, args.max_length, len(label2id), generator=generator
+    )
+    lengths = torch.randint(
+        1, args.max_length + 1, (args.n_sequences,), generator=generator
+    )
+    mask = torch.arange(args.max_length) < lengths.unsqueeze(1)
+
+    decoders = {
+        "naive loop": lambda: naive_viterbi_decode(
+            emissions, mask, start_transitions, transitions, end_transitions
+        ),
+        "batched": lambda: viterbi_decode(
+            emissions, mask, start_transitions, transitions, end_transitions
+        ),
+        "batched sparse": lambda: sparse_viterbi_decode(
+            emissions, mask, start_transitions, sparse, end_transitions
+        ),
+    }
+    paths = {}
+    for name, decode in decoders.items():
+        start = time.perf_counter()
+        paths[name] = decode()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {args.n_sequences / elapsed:.1f} sequences/sec")
+
+    # sparseは遷移できない組も含めてviterbi_decodeと同じ計算をするので、ラベル列まで一致する
+    assert paths["batched sparse"] == paths["batched"]
+    # naive loopはPythonのfloat（64bit）で計算するので、
+    # スコアがほぼ同じラベル列の間では選ぶものが変わりうる。
+    # そこで、ラベル列は一致した数を数え、スコアは誤差の範囲で一致することを確かめる
+    expected_paths = paths["naive loop"]
+    expected_scores = path_scores(
+        emissions,
+        start_transitions,
+        transitions,
+        end_transitions,
+        expected_paths,
+    )
+    n_same = sum(
+        actual == expected
+        for actual, expected in zip(paths["batched"], expected_paths)
+    )
+    print(f"batched: {n_same} / {args.n_sequences} paths same as naive loop")
+    scores = path_scores(
+        emissions,
+        start_transitions,
+        transitions,
+        end_transitions,
+        paths["batched"],
+    )
+    assert torch.allclose(scores, expected_scores)